@@ -0,0 +1,104 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import config
+import utils
+from data_loader import MASTER_TABLES, build_queries, get_sorting, get_threshold, prepare_tables, read_tables
+from entities import build_entity_dictionary, encode_inputs
+from main import summarize_mapping
+from resource_mapper import map_sales
+
+
+# optimizer tables of the dataset in the worker processes, set once per worker
+master_tables = {}
+
+
+def set_master_tables(tables):
+    """ Keeps the optimizer tables of the dataset in the worker process """
+    master_tables.update(tables)
+
+
+def map_run(runid, results_tables):
+    """
+    Prepares, maps and exports one run in a worker process
+    :param runid: int, run of the results tables
+    :param results_tables: dict, pd.DataFrame of each results table of the run
+    :return: tuple: runid, number of mapped sales and number of rows of the summary table
+    """
+    # the preparation writes into the tables, so every run gets its own copy of the optimizer tables
+    tables = {table: df.copy() for table, df in master_tables.items()}
+    tables.update(results_tables)
+    inputs = prepare_tables(tables, config.time_direction, config.priority, config.lead_time, config.numeric_mode,
+                            config.categoricals)
+    entities = build_entity_dictionary(inputs)
+    inputs = encode_inputs(inputs, entities)
+    df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity, df_demand = inputs
+
+    # map the sales of the run
+    threshold = get_threshold(config.threshold, config.numeric_mode)
+    mapped_records, resource_state = map_sales(
+        df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity,
+        config.map_priority, threshold, config.engine, verbose=False
+    )
+
+    # export the summary table of the run
+    summary_table = summarize_mapping(inputs, mapped_records, resource_state, runid, entities)
+    utils.export_summary_table(summary_table, f'results/marking_demand_{runid}')
+
+    return runid, len(df_sales), len(summary_table)
+
+
+def run_batch(runids, workers=1):
+    """
+    Maps the runs of config.configid and config.datasetid, writing one summary table per run.
+    The optimizer tables are read once and shared by the runs, the results tables of a run are read
+    while the previous runs are mapped in the pool of worker processes
+    :param runids: list, runs to map
+    :param workers: int, number of runs mapped at the same time
+    :return: dict, number of mapped sales and number of rows of the summary table of each runid
+    """
+    sorting = get_sorting(config.time_direction)
+
+    # read the optimizer tables once
+    queries = build_queries(config.configid, config.datasetid, None, config.period, sorting, config.threshold)
+    tables = read_tables({table: queries[table] for table in MASTER_TABLES}, config.load_method,
+                         config.numeric_mode, config.db_connections)
+
+    summary = {}
+
+    def collect(futures):
+        for future in futures:
+            runid, sales, rows = future.result()
+            summary[runid] = {'sales': sales, 'rows': rows}
+            print(f'Run: {runid} has been mapped: {sales} sales, {rows} rows.')
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_master_tables, initargs=(tables,)) as executor:
+        pending = set()
+        for runid in runids:
+            # read the results tables of the run
+            queries = build_queries(config.configid, config.datasetid, runid, config.period, sorting,
+                                    config.threshold)
+            results_tables = read_tables({table: query for table, query in queries.items()
+                                          if table not in MASTER_TABLES},
+                                         config.load_method, config.numeric_mode, config.db_connections)
+            pending.add(executor.submit(map_run, runid, results_tables))
+
+            # keep at most one run per worker waiting, so the results tables of all runs are not held at once
+            if len(pending) > workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        collect(wait(pending).done)
+
+    return {runid: summary[runid] for runid in runids}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maps many runs of the configid and datasetid of the config')
+    parser.add_argument('runids', nargs='*', type=int, default=config.batch_runids,
+                        help='runs to map, config.batch_runids if not given')
+    parser.add_argument('--workers', type=int, default=config.batch_workers,
+                        help='number of runs mapped at the same time')
+    args = parser.parse_args()
+
+    run_batch(args.runids, args.workers)
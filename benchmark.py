@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import config
+from data_loader import prepare_tables, get_threshold
+from entities import build_entity_dictionary, encode_inputs, decode_entities
+from main import calculate_cost, process_mapped_resources
+from mapped_records import materialize_mapped_records
+from resource_mapper import map_sales
+from resource_state import update_resource_frames
+from synthetic_data import generate_tables
+
+
+# parameters of the synthetic supply networks of each scale
+SCALES = {
+    'small': {'products': 12, 'locations': 6, 'periods': 3, 'bom_depth': 2, 'fan_in': 2, 'lanes': 20, 'sales': 100},
+    'medium': {'products': 60, 'locations': 12, 'periods': 6, 'bom_depth': 3, 'fan_in': 3, 'lanes': 150,
+               'sales': 1000},
+    'large': {'products': 200, 'locations': 30, 'periods': 12, 'bom_depth': 4, 'fan_in': 3, 'lanes': 1000,
+              'sales': 10000},
+}
+
+
+def get_commit():
+    """ Returns the hash of the checked out commit, None outside of a git repository """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(scale, parameters, seed=0):
+    """
+    Times the steps of run_resource_mapper on a synthetic supply network
+    :param scale: str, name of the scale
+    :param parameters: dict, parameters of generate_tables
+    :param seed: int, seed of the synthetic data
+    :return: dict, benchmark result with the duration of each step in seconds
+    """
+    timings = {}
+    tables = generate_tables(**parameters, time_direction=config.time_direction, seed=seed)
+
+    # data_loader without the queries
+    start = time.perf_counter()
+    inputs = prepare_tables(tables, config.time_direction, config.priority, config.lead_time, config.numeric_mode,
+                            config.categoricals)
+    timings['prepare_tables'] = time.perf_counter() - start
+
+    # integer codes of the entities
+    start = time.perf_counter()
+    entities = build_entity_dictionary(inputs)
+    df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity, df_demand = encode_inputs(
+        inputs, entities
+    )
+    timings['encode_entities'] = time.perf_counter() - start
+
+    # mapping
+    threshold = get_threshold(config.threshold, config.numeric_mode)
+    start = time.perf_counter()
+    mapped_records, resource_state = map_sales(
+        df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity,
+        config.map_priority, threshold, config.engine, verbose=False
+    )
+    timings['map_sales'] = time.perf_counter() - start
+
+    # mapped DataFrames
+    start = time.perf_counter()
+    update_resource_frames(resource_state, df_stock, df_production, df_movement, df_procurement, df_capacity)
+    mapped_sales, mapped_stock, mapped_production, mapped_movement, mapped_procurement, mapped_capacity = [
+        decode_entities(df, entities) for df in materialize_mapped_records(mapped_records)
+    ]
+    timings['materialize_mapped_records'] = time.perf_counter() - start
+
+    # costs
+    start = time.perf_counter()
+    mapped_sales, mapped_stock, mapped_production, mapped_movement, mapped_procurement = calculate_cost(
+        (mapped_sales, mapped_stock, mapped_production, mapped_movement, mapped_procurement)
+    )
+    timings['calculate_cost'] = time.perf_counter() - start
+
+    # summary table
+    start = time.perf_counter()
+    summary_table = process_mapped_resources(
+        (mapped_sales, mapped_stock, mapped_production, mapped_movement, mapped_procurement, mapped_capacity),
+        df_demand
+    )
+    timings['process_mapped_resources'] = time.perf_counter() - start
+
+    return {
+        'commit': get_commit(),
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'scale': scale,
+        'parameters': parameters,
+        'seed': seed,
+        'numeric_mode': config.numeric_mode,
+        'engine': config.engine,
+        'rows': {'sales': len(df_sales), 'stock': len(df_stock), 'production': len(df_production),
+                 'movement': len(df_movement), 'procurement': len(df_procurement), 'bom': len(df_bom),
+                 'capacity': len(df_capacity), 'summary': len(summary_table)},
+        'timings': timings,
+    }
+
+
+def compare_results(path):
+    """ Prints the timings of the stored benchmark results, one line per commit and scale """
+    with open(path) as file:
+        results = [json.loads(line) for line in file if line.strip()]
+
+    for result in results:
+        timings = ' '.join(f'{step}={duration:.3f}s' for step, duration in result['timings'].items())
+        print(f"{result['commit']} {result['time']} {result['scale']} {result['numeric_mode']}: {timings}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times the resource mapper on synthetic supply networks')
+    parser.add_argument('--scales', nargs='+', default=['small'], choices=list(SCALES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.jsonl', help='file the results are appended to')
+    parser.add_argument('--compare', action='store_true', help='print the stored results instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(args.output)
+    else:
+        for scale in args.scales:
+            result = run_benchmark(scale, SCALES[scale], args.seed)
+            print(json.dumps(result))
+            with open(args.output, 'a') as file:
+                file.write(json.dumps(result) + '\n')
@@ -0,0 +1,31 @@
+import numpy as np
+
+
+def group_positions(bomnums, periods, mask=None):
+    """ Groups the row positions by (bomnum, period) into arrays, keeping the order of the rows """
+    groups = {}
+    for position, key in enumerate(zip(bomnums, periods)):
+        if mask is None or mask[position]:
+            groups.setdefault(key, []).append(position)
+    return {key: np.array(positions, dtype=np.intp) for key, positions in groups.items()}
+
+
+def build_bom_index(df_bom, df_capacity):
+    """
+    Builds the index of the BOM inputs and of the capacity rows of each (bomnum, period), once per run,
+    so that an allocated production does not filter the whole BOM and capacity tables
+    :param df_bom: pd.Dataframe with BOMs data
+    :param df_capacity: pd.Dataframe, data related to production capacities
+    :return: dict, arrays of row positions for each (bomnum, period) of the BOM inputs and of the capacities,
+             and the capacity consumption per unit of production of each capacity row
+    """
+    return {
+        'bom': group_positions(df_bom['bomnum'], df_bom['period'], (df_bom['input_output'] < 0).to_numpy()),
+        'capacity': group_positions(df_capacity['bomnum'], df_capacity['period']),
+        'var_production_cons': df_capacity['var_production_cons'].to_numpy(),
+    }
+
+
+def lookup_bom(bom_index, table, bomnum, period):
+    """ Returns the positions of the BOM inputs or of the capacity rows of the bomnum in the period """
+    return bom_index[table].get((bomnum, period), np.empty(0, dtype=np.intp))
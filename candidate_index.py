@@ -0,0 +1,116 @@
+from bisect import bisect_left, insort
+
+import numpy as np
+
+
+def has_lead_time(leadtime):
+    """ Checks that the lead time is not missing after the merge with optimizer data """
+    return leadtime is not None and leadtime == leadtime
+
+
+def build_bucket(keys, leftovers, periods, threshold):
+    """
+    Groups row positions by key, keeping only the rows with a leftover above threshold.
+    The buckets hold the ranks of the rows in the candidate order, period descending and row position ascending
+    within a period, so that a lookup returns the candidates in the order they are allocated
+    """
+    # candidate order of the rows and rank of each row position in it
+    order = np.argsort(-np.asarray(periods, dtype=float), kind='stable').tolist()
+    ranks = [0] * len(order)
+    for rank, position in enumerate(order):
+        ranks[position] = rank
+
+    buckets = {}
+    for rank, position in enumerate(order):
+        key = keys[position]
+        if key is not None and abs(leftovers[position]) > threshold:
+            buckets.setdefault(key, []).append(rank)
+    return {'keys': keys, 'buckets': buckets, 'order': order, 'ranks': ranks}
+
+
+def build_candidate_index(df_stock, df_production, df_movement, df_procurement, threshold):
+    """
+    Builds the index of resource rows that can supply an order, once per run.
+    Rows are grouped by (product, loc_to, arrival period), so that a lookup only touches the rows that match the order.
+    Stock is indexed twice: by the next period for stock orders (solutionvalue leftover)
+    and by the current period for other orders (period_spent leftover).
+    Procurement is keyed by (product, loc_to) only, because it supplies any later period.
+    The candidates of a key are allocated from the latest period to the earliest one, and in the order of the rows
+    of the resource table within a period.
+    :param df_stock: pd.Dataframe, data related to storage
+    :param df_production: pd.DataFrame, data related to production
+    :param df_movement: pd.Dataframe, data related to transportation
+    :param df_procurement: pd.Dataframe, data related to procurement
+    :param threshold: Decimal or float, threshold for comparing real numbers in the type of the quantities
+    :return: dict, buckets of sorted row positions for each resource table
+    """
+    # stock for stock orders is taken from the previous period
+    stock_sv_keys = [(product, loc_to, period + 1) for product, loc_to, period in
+                     zip(df_stock['product'], df_stock['loc_to'], df_stock['period'])]
+    stock_ps_keys = [(product, loc_to, period) for product, loc_to, period in
+                     zip(df_stock['product'], df_stock['loc_to'], df_stock['period'])]
+
+    # production and movement arrive after the lead time, rows without lead time are never selected
+    production_keys = [(product, loc_to, period + leadtime) if has_lead_time(leadtime) else None
+                       for product, loc_to, period, leadtime in
+                       zip(df_production['product'], df_production['loc_to'], df_production['period'],
+                           df_production['leadtime'])]
+    movement_keys = [(product, loc_to, period + leadtime) if has_lead_time(leadtime) else None
+                     for product, loc_to, period, leadtime in
+                     zip(df_movement['product'], df_movement['loc_to'], df_movement['period'],
+                         df_movement['leadtime'])]
+
+    # procurement of any earlier period can be used
+    procurement_keys = list(zip(df_procurement['product'], df_procurement['loc_to']))
+
+    candidate_index = {
+        'stock_sv': build_bucket(stock_sv_keys, df_stock['sv_leftover'].tolist(), df_stock['period'], threshold),
+        'stock_ps': build_bucket(stock_ps_keys, df_stock['ps_leftover'].tolist(), df_stock['period'], threshold),
+        'production': build_bucket(production_keys, df_production['leftover'].tolist(), df_production['period'],
+                                   threshold),
+        'movement': build_bucket(movement_keys, df_movement['leftover'].tolist(), df_movement['period'], threshold),
+        'procurement': build_bucket(procurement_keys, df_procurement['leftover'].tolist(), df_procurement['period'],
+                                    threshold),
+    }
+    candidate_index['procurement']['period'] = df_procurement['period'].tolist()
+
+    return candidate_index
+
+
+def lookup_candidates(candidate_index, bucket, key):
+    """ Returns the positions of the rows that can supply the key in the candidate order """
+    order = candidate_index[bucket]['order']
+    return [order[rank] for rank in candidate_index[bucket]['buckets'].get(key, ())]
+
+
+def update_candidate(candidate_index, bucket, position, leftover, threshold):
+    """ Adds or removes the row from its bucket according to the updated leftover """
+    key = candidate_index[bucket]['keys'][position]
+    if key is None:
+        return
+    rank = candidate_index[bucket]['ranks'][position]
+    ranks = candidate_index[bucket]['buckets'].setdefault(key, [])
+    i = bisect_left(ranks, rank)
+    indexed = i < len(ranks) and ranks[i] == rank
+    if abs(leftover) > threshold:
+        if not indexed:
+            insort(ranks, rank)
+    elif indexed:
+        del ranks[i]
+
+
+# leftover in the resource state of the rows of each bucket
+BUCKET_LEFTOVERS = {
+    'stock_sv': ('stock', 'sv_leftover'),
+    'stock_ps': ('stock', 'ps_leftover'),
+    'production': ('production', 'leftover'),
+    'movement': ('movement', 'leftover'),
+    'procurement': ('procurement', 'leftover'),
+}
+
+
+def refresh_candidates(candidate_index, resource_state, threshold):
+    """ Updates the buckets of all rows with the leftovers of the resource state, e.g. of a resumed mapping """
+    for bucket, (table, column) in BUCKET_LEFTOVERS.items():
+        for position, leftover in enumerate(resource_state[table][column]):
+            update_candidate(candidate_index, bucket, position, leftover, threshold)
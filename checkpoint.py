@@ -0,0 +1,145 @@
+import os
+import pickle
+import tempfile
+
+from mapped_records import index_last_rows
+
+
+def get_leftovers_path(path):
+    """ Returns the path of the file of the leftovers of the checkpoint """
+    return f'{path}.leftovers'
+
+
+def build_checkpoint_log(mapped_records):
+    """
+    Creates the record of what the checkpoint file holds: the number of saved rows of each mapped table,
+    and the positions and saved residuals of the rows which were the latest rows of their keys at the last save.
+    Only these rows can change after they are saved, as the residual of the latest row of a keys is updated
+    :param mapped_records: dict, mapped rows of the orders
+    :return: dict, saved rows of each mapped table
+    """
+    log = {}
+    for table, records in mapped_records.items():
+        last_rows = {id(row) for row in records.get('last', {}).values()}
+        log[table] = {'saved': len(records['rows']), 'last': {}}
+        if last_rows:
+            residual_position = records['columns'].get_loc('residual')
+            log[table]['last'] = {id(row): (position, row[residual_position])
+                                  for position, row in enumerate(records['rows']) if id(row) in last_rows}
+    return log
+
+
+def save_checkpoint(path, log, order_ids, completed, resource_state, mapped_records, traces=None, stats=None):
+    """
+    Saves the progress of the mapping since the last save.
+    The rows mapped since the last save and the saved rows whose residual was updated since are appended
+    to the checkpoint file, so it grows with the mapped rows only. The leftovers of the resources replace
+    the previous ones in their own file, which is written into a temporary file and renamed
+    :param path: str, path of the checkpoint file
+    :param log: dict, saved rows of each mapped table, updated with the appended rows
+    :param order_ids: list, order_ids of the sales mapped since the last save, in their order
+    :param completed: int, number of sales mapped in all
+    :param resource_state: dict, leftovers of the resources after the orders
+    :param mapped_records: dict, mapped rows of the orders
+    :param traces: dict, lookups and resource updates of the orders
+    :param stats: dict, counters of the orders
+    """
+    order_ids = list(order_ids)
+    segment = {
+        'order_ids': order_ids,
+        'tables': {},
+        'traces': {order_id: traces[order_id] for order_id in order_ids} if traces is not None else None,
+        'stats': {order_id: stats[order_id] for order_id in order_ids} if stats is not None else None,
+    }
+    for table, records in mapped_records.items():
+        table_log = log[table]
+        rows = records['rows']
+        saved = table_log['saved']
+        segment['tables'][table] = {
+            'rows': rows[saved:],
+            'index': records['index'][saved:] if 'index' in records else None,
+            'updated': {},
+        }
+        if records.get('last'):
+            # the residual of an updated row is a new object
+            residual_position = records['columns'].get_loc('residual')
+            segment['tables'][table]['updated'] = {
+                position: rows[position] for position, residual in table_log['last'].values()
+                if rows[position][residual_position] is not residual
+            }
+            positions = {id(row): position for position, row in enumerate(rows[saved:], start=saved)}
+            positions.update({row_id: position for row_id, (position, _) in table_log['last'].items()})
+            table_log['last'] = {id(row): (positions[id(row)], row[residual_position])
+                                 for row in records['last'].values()}
+        table_log['saved'] = len(rows)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'ab') as file:
+        pickle.dump(segment, file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.flush()
+        os.fsync(file.fileno())
+
+    # the leftovers are written after the rows, so they never belong to rows which were not saved
+    file_descriptor, temp_path = tempfile.mkstemp(prefix='.checkpoint.', dir=os.path.dirname(path) or '.')
+    with os.fdopen(file_descriptor, 'wb') as file:
+        pickle.dump({'completed': completed, 'resource_state': resource_state}, file,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, get_leftovers_path(path))
+
+
+def load_checkpoint(path, order_ids, mapped_records):
+    """
+    Loads the progress of an interrupted mapping into the empty mapped records.
+    Saves appended after the saved leftovers, or interrupted while they were appended, are cut from the file,
+    the mapping continues from the save of the leftovers
+    :param path: str, path of the checkpoint file
+    :param order_ids: pd.Index, order_ids of the sales to be mapped, the checkpoint must be of their first orders
+    :param mapped_records: dict, empty mapped rows, filled with the saved rows
+    :return: dict, mapped order_ids, leftovers, traces, stats and log of the checkpoint, or None if there is none
+    """
+    leftovers_path = get_leftovers_path(path)
+    if not os.path.isfile(path) or not os.path.isfile(leftovers_path):
+        return None
+    with open(leftovers_path, 'rb') as file:
+        leftovers = pickle.load(file)
+
+    checkpoint = {'order_ids': [], 'resource_state': leftovers['resource_state'], 'traces': {}, 'stats': {}}
+    with open(path, 'rb') as file:
+        while len(checkpoint['order_ids']) < leftovers['completed']:
+            try:
+                segment = pickle.load(file)
+            except (EOFError, pickle.UnpicklingError):
+                raise ValueError(f'The checkpoint {path} does not hold the rows of its leftovers')
+            checkpoint['order_ids'].extend(segment['order_ids'])
+            for key in ['traces', 'stats']:
+                if segment[key] is not None:
+                    checkpoint[key].update(segment[key])
+            for table, saved in segment['tables'].items():
+                records = mapped_records[table]
+                for position, row in saved['updated'].items():
+                    records['rows'][position] = row
+                records['rows'].extend(saved['rows'])
+                if saved['index'] is not None:
+                    records['index'].extend(saved['index'])
+        end = file.tell()
+    os.truncate(path, end)
+
+    # the checkpoint can only be continued with the sales it was saved for
+    completed = len(checkpoint['order_ids'])
+    if checkpoint['order_ids'] != list(order_ids[:completed]):
+        raise ValueError(f'The checkpoint {path} was saved for other sales')
+
+    # the latest rows of the keys are found again in the order the rows were mapped
+    for table, records in mapped_records.items():
+        if 'last' in records:
+            index_last_rows(records, records['rows'])
+
+    checkpoint['log'] = build_checkpoint_log(mapped_records)
+    return checkpoint
+
+
+def remove_checkpoint(path):
+    """ Removes the checkpoint once the run is completed """
+    for checkpoint_path in [path, get_leftovers_path(path)]:
+        if os.path.isfile(checkpoint_path):
+            os.remove(checkpoint_path)
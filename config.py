@@ -6,8 +6,62 @@ runid = 28
 lead_time = True  # False makes lead times 0. Use with duration switched off in optimizer config
 period = 0, 1, 2
 threshold = Decimal('0.10')
+# 'decimal' keeps NUMERIC columns as Decimal objects, 'float' converts quantities to float64 in data_loader.
+# Float results match the Decimal ones within an absolute tolerance of 1e-6 on volumes and costs,
+# unless a residual falls within that tolerance of the threshold
+numeric_mode = 'decimal'
+# 'fetch' loads the query results with cursor.fetchall, 'copy' streams them with COPY ... TO STDOUT,
+# 'stream' reads them in batches from server-side cursors, so only one batch of rows is held as Python tuples
+load_method = 'fetch'
+# True loads the location, product, client, supplier, transport_type, operation_type and keys columns as pandas
+# categoricals sharing one set of categories per entity, False keeps them as Python strings
+categoricals = True
+# number of rows of the batches of the 'stream' load method
+stream_batch_size = 100000
+# number of pooled database connections, the tables of data_loader are read concurrently on them
+db_connections = 11
+# directory of the local cache of the loaded inputs, None loads them from the database on every run.
+# A cached run is not reloaded when its results tables change in the database, unless refresh_cache is set
+cache_dir = None
+# maximum size of the cache in bytes, the least recently used runs are evicted above it
+cache_size = 2 * 1024 ** 3
+# True reloads the inputs of the run from the database and replaces its cache entry
+refresh_cache = False
+# format of the exported tables: 'excel', 'parquet', 'csv' or 'arrow' (Arrow IPC), parquet and arrow need pyarrow
+output_format = 'excel'
+# compression of the parquet, csv and arrow outputs, None uses the default of the format
+output_compression = None
+# number of rows of the parquet row groups and of the arrow record batches, None writes a single group
+output_row_group_size = None
+# directory of the saved mappings of the runs, None does not save them
+mapping_dir = None
+# runid of a saved mapping to reuse: only the orders affected by the changed inputs are mapped again
+previous_runid = None
 time_direction = 'backward'
 priority = 'revenue'
+# 'recursive' or 'iterative' mapping engine, the iterative engine is not limited by the recursion depth
+engine = 'recursive'
+# number of worker processes mapping independent components of the supply network, 1 maps all sales serially
+workers = 1
+# runs of the configid and datasetid mapped by batch.py, each run is written into its own summary table
+batch_runids = ()
+# number of runs mapped at the same time by batch.py
+batch_workers = 1
+# (time_direction, priority) of the scenarios compared by scenarios.py
+scenarios = [('backward', 'revenue'), ('forward', 'revenue')]
+# number of scenarios mapped at the same time by scenarios.py
+scenario_workers = 2
+# .json or .csv file of the per-order counters and timings of the mapping, None does not collect them
+stats_file = None
+# directory of the checkpoints of the serial mapping, main.py --resume continues an interrupted run from its checkpoint,
+# None does not save checkpoints
+checkpoint_dir = None
+# number of orders mapped between two checkpoints, None does not count the orders.
+# Each checkpoint appends the rows mapped since the previous one to the file and rewrites the leftovers of all
+# resources in a file of their own
+checkpoint_orders = 1000
+# seconds between two checkpoints, None does not time the checkpoints
+checkpoint_seconds = 600
 map_priority = {
     'stock': 1,
     'production': 0,
@@ -1,63 +1,442 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
 import pandas as pd
 import numpy as np
 import config
-from db_connect import db_connect
-
-
-def data_loader(configid, datasetid, runid, period, time_direction, priority, lead_time=True):
-    # connect to database
-    conn = db_connect()
-    cursor = conn.cursor()
-
-    # set up sorting
+from db_connect import get_connection_pool
+
+
+# PostgreSQL type codes of the columns parsed from COPY output
+NUMERIC_TYPE = 1700
+INTEGER_TYPES = {20, 21, 23}
+FLOAT_TYPES = {700, 701}
+
+
+# quantity columns of the frames returned by data_loader
+QUANTITY_COLUMNS = {
+    'sales': ['solutionvalue', 'quantity', 'price', 'revenue', 'residual'],
+    'stock': ['solutionvalue', 'initialstock', 'cost', 'coefficient', 'period_spent', 'extra_res',
+              'is_leftover', 'sv_leftover', 'ps_leftover', 'er_leftover'],
+    'production': ['solutionvalue', 'cost', 'coefficient', 'leftover'],
+    'movement': ['solutionvalue', 'cost', 'coefficient', 'leftover'],
+    'procurement': ['solutionvalue', 'cost', 'coefficient', 'leftover'],
+    'bom': ['input_output'],
+    'capacity': ['capacity', 'var_production_cons', 'leftover'],
+    'demand': ['quantity', 'price'],
+}
+
+
+# optimizer tables of the dataset, shared by all runs of a configid and datasetid
+MASTER_TABLES = ['optimizer_production', 'optimizer_transportation', 'optimizer_procurement', 'optimizer_storage',
+                 'optimizer_demand', 'optimizer_bom']
+
+
+# columns holding the names of each entity, the columns of an entity share one categorical dtype across the frames
+ENTITY_COLUMNS = {
+    'location': ['location', 'loc_from', 'loc_to'],
+    'product': ['product'],
+    'client': ['client'],
+    'supplier': ['supplier'],
+    'transport_type': ['transport_type'],
+    'operation_type': ['operation_type'],
+    'keys': ['keys', 'label'],
+}
+
+# tables whose queries order the rows by period
+PERIOD_ORDERED_TABLES = ['results_production', 'results_movement', 'optimizer_procurement', 'results_procurement',
+                         'optimizer_storage', 'results_stock', 'optimizer_demand', 'results_sale', 'optimizer_bom']
+
+
+def convert_quantities(df, table, numeric_mode):
+    """ Converts the Decimal quantities returned by psycopg2 into float64 in the 'float' numeric mode """
+    if numeric_mode == 'float':
+        df = df.astype({column: 'float64' for column in QUANTITY_COLUMNS[table]})
+    return df
+
+
+def build_entity_dtypes(frames):
+    """
+    Creates one categorical dtype per entity, with the names of the entity found in any of the frames as categories,
+    so that the entity columns of all frames share their categories and are merged and grouped on integer codes
+    :param frames: list of pd.DataFrames
+    :return: dict, pd.CategoricalDtype of each entity column
+    """
+    dtypes = {}
+    for columns in ENTITY_COLUMNS.values():
+        names = set()
+        for df in frames:
+            for column in columns:
+                if column in df.columns:
+                    names.update(df[column].dropna())
+        dtype = pd.CategoricalDtype(sorted(names, key=str))
+        dtypes.update({column: dtype for column in columns})
+    return dtypes
+
+
+def to_categoricals(df, dtypes):
+    """ Converts the entity columns of the DataFrame into their shared categorical dtypes """
+    return df.astype({column: dtype for column, dtype in dtypes.items() if column in df.columns})
+
+
+def get_threshold(threshold, numeric_mode):
+    """ Returns the threshold in the type of the quantities of the numeric mode """
+    if numeric_mode == 'float':
+        return float(threshold)
+    return threshold
+
+
+def build_keys(df, columns):
+    """
+    Joins the string values of the columns into '.'-separated keys, column by column
+    :param df: pd.DataFrame, table to create the keys for
+    :param columns: list, columns of the key in their order
+    :return: pd.Series, keys of the rows
+    """
+    keys = df[columns[0]].astype(str)
+    for column in columns[1:]:
+        keys = keys + '.' + df[column].astype(str)
+    return keys
+
+
+def fetch_query(cursor, query, params=None):
+    """ Runs the query with its parameters and fetches all rows into a DataFrame """
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    return pd.DataFrame(rows, columns=[desc[0] for desc in cursor.description])
+
+
+def copy_rows(cursor, query, write_fd):
+    """ Writes the result of the query as CSV into the write end of the pipe and closes it after the last row """
+    with open(write_fd, 'wb') as writer:
+        cursor.copy_expert(f'COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)', writer)
+
+
+def get_copy_types(description, numeric_mode='decimal'):
+    """
+    Returns the dtypes and the converters of the CSV columns of the COPY output.
+    Numbers are parsed by the CSV parser, NUMERIC columns into float64 in the 'float' numeric mode and into Decimal
+    in the 'decimal' mode, integer columns are inferred as int64, or float64 when they hold NULLs.
+    Only the other columns are read as str
+    :param description: cursor description of the columns of the query
+    :return: tuple of dicts: dtype and converter of the columns (dtypes, converters)
+    """
+    dtypes, converters = {}, {}
+    for desc in description:
+        if desc.type_code == NUMERIC_TYPE and numeric_mode == 'decimal':
+            converters[desc.name] = to_decimal
+        elif desc.type_code == NUMERIC_TYPE or desc.type_code in FLOAT_TYPES:
+            dtypes[desc.name] = 'float64'
+        elif desc.type_code not in INTEGER_TYPES:
+            dtypes[desc.name] = str
+    return dtypes, converters
+
+
+def to_decimal(value):
+    """ Parses a NUMERIC value of the CSV, an empty value is NULL """
+    return Decimal(value) if value else np.nan
+
+
+def copy_query(cursor, query, params=None, numeric_mode='decimal'):
+    """
+    Streams the result of the query with COPY ... TO STDOUT as CSV through a pipe into the CSV parser,
+    which parses the rows as they arrive, so neither the whole CSV nor a frame of str cells is held.
+    The column types are taken from an empty result of the query, NUMERIC columns are parsed into Decimal
+    in the 'decimal' numeric mode and into float64 in the 'float' mode
+    """
+    # COPY does not take parameters, bind them on the client
+    if params is not None:
+        query = cursor.mogrify(query, params).decode()
+
+    # get the column types
+    cursor.execute(f'SELECT * FROM ({query}) AS query LIMIT 0')
+    dtypes, converters = get_copy_types(cursor.description, numeric_mode)
+
+    # the rows are written into the pipe by a thread and parsed from it at the same time
+    read_fd, write_fd = os.pipe()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        copying = executor.submit(copy_rows, cursor, query, write_fd)
+        try:
+            with open(read_fd, 'rb') as reader:
+                df = pd.read_csv(reader, dtype=dtypes, converters=converters, keep_default_na=False,
+                                 na_values=[''], float_precision='round_trip')
+        except Exception:
+            # a failed COPY ends the rows early, its error explains the failed parse,
+            # a failed parse closes the pipe and stops the COPY
+            error = copying.exception()
+            if error is not None and not isinstance(error, BrokenPipeError):
+                raise error
+            raise
+        copying.result()
+
+    # the converters return objects, keep the Decimal columns as object even if they only hold NULLs
+    for column in converters:
+        df[column] = df[column].astype(object)
+
+    return df
+
+
+def stream_query(cursor, query, params=None, numeric_mode='decimal', batch_size=100000):
+    """
+    Runs the query on a named server-side cursor and reads its result in batches of rows.
+    Every batch is turned into a DataFrame as it arrives, NUMERIC columns are converted into float64 in the 'float'
+    numeric mode, so only one batch of Python tuples is held at a time.
+    The batches are kept per column and the columns of the result are concatenated one at a time,
+    releasing the batches of a column once it is built, so the memory peaks at the final frame and one column.
+    The queries already project the columns, filter the values by the threshold and remove the duplicate rows
+    on the server, so the batches are only concatenated in the order of the query
+    """
+    cursor.itersize = batch_size
+    cursor.execute(query, params)
+
+    batches = None
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        # the description of a named cursor is known after the first fetch
+        columns = [desc[0] for desc in cursor.description]
+        df = pd.DataFrame(rows, columns=columns)
+        del rows
+        if numeric_mode == 'float':
+            for desc in cursor.description:
+                if desc.type_code == NUMERIC_TYPE:
+                    df[desc.name] = pd.to_numeric(df[desc.name]).astype('float64')
+        # an empty last batch would turn the dtypes of the concatenated columns into object
+        if len(df) > 0 or batches is None:
+            if batches is None:
+                batches = {column: [] for column in columns}
+            # each column owns its values, so the batches of a concatenated column are released
+            for column in columns:
+                batches[column].append(df[column].copy())
+        if len(df) < batch_size:
+            break
+        del df
+
+    # concatenate the result column by column
+    df = pd.DataFrame(index=pd.RangeIndex(sum(len(batch) for batch in batches[columns[0]])))
+    for column in columns:
+        df[column] = pd.concat(batches.pop(column), ignore_index=True)
+    return df
+
+
+def read_query(cursor, query, params=None, load_method='fetch', numeric_mode='decimal'):
+    """
+    Reads the result of the parameterized query into a DataFrame with the load method: 'fetch', 'copy' or 'stream',
+    the 'stream' method needs a named cursor
+    """
+    if load_method == 'copy':
+        return copy_query(cursor, query, params, numeric_mode)
+    if load_method == 'stream':
+        return stream_query(cursor, query, params, numeric_mode, config.stream_batch_size)
+    return fetch_query(cursor, query, params)
+
+
+def get_sorting(time_direction):
+    """ Returns the order of the periods in the queries of the time direction """
     if time_direction == 'forward':
-        sorting = 'ASC'
-    else:
-        sorting = 'DESC'
-
+        return 'ASC'
+    return 'DESC'
+
+
+def sort_tables(tables, time_direction):
+    """
+    Orders the rows of the tables read with the other time direction by period, as the queries of the time direction
+    do. The sort is stable, so the rows of a period keep the order they were read in
+    :param tables: dict, pd.DataFrame of each queried table, as returned by read_tables
+    :return: dict, pd.DataFrame of each table, the period ordered tables are copies
+    """
+    ascending = get_sorting(time_direction) == 'ASC'
+    return {
+        table: df.sort_values('period', ascending=ascending, kind='stable', key=lambda period: period.astype(int))
+        .reset_index(drop=True) if table in PERIOD_ORDERED_TABLES else df
+        for table, df in tables.items()
+    }
+
+
+def build_queries(configid, datasetid, runid, period, sorting, threshold):
+    """
+    Creates the parameterized queries of the tables loaded by data_loader
+    :param sorting: str, 'ASC' or 'DESC' order of the periods
+    :param threshold: Decimal, values of the results and demands not above it are filtered out
+    :return: dict, query and its parameters of each table
+    """
+    queries = {
+        # production lead times and capacities are read from the same rows
+        'optimizer_production': ("""
+            SELECT DISTINCT location, product, bomnum, period, duration, cost, coefficient, resource, capacity,
+                            var_production_cons
+            FROM optimizer_production
+            WHERE datasetid = %s AND period IN %s
+        """, (datasetid, period)),
+        'results_production': (f"""
+            SELECT *
+            FROM (
+                SELECT DISTINCT location, product, bomnum, period, solutionvalue
+                FROM results_production
+                WHERE configid = %s AND datasetid = %s AND runid = %s AND period IN %s AND ABS(solutionvalue) > %s
+            ) AS results_production
+            ORDER BY CAST(period AS int) {sorting}
+        """, (configid, datasetid, runid, period, threshold)),
+        'optimizer_transportation': ("""
+            SELECT DISTINCT loc_from, loc_to, product, period, transport_type, duration, cost, coefficient
+            FROM optimizer_transportation
+            WHERE datasetid = %s AND period IN %s
+        """, (datasetid, period)),
+        'results_movement': (f"""
+            SELECT *
+            FROM (
+                SELECT DISTINCT loc_from, loc_to, product, period, solutionvalue, transport_type
+                FROM results_movement
+                WHERE configid = %s AND datasetid = %s AND runid = %s AND period IN %s AND ABS(solutionvalue) > %s
+            ) AS results_movement
+            ORDER BY CAST(period AS int) {sorting}
+        """, (configid, datasetid, runid, period, threshold)),
+        'optimizer_procurement': (f"""
+            SELECT *
+            FROM (
+                SELECT DISTINCT location, product, period, supplier, cost, coefficient
+                FROM optimizer_procurement
+                WHERE datasetid = %s AND period IN %s
+            ) AS procurement
+            ORDER BY CAST(period AS int) {sorting}
+        """, (datasetid, period)),
+        'results_procurement': (f"""
+            SELECT *
+            FROM (
+                SELECT DISTINCT location, product, period, solutionvalue, supplier
+                FROM results_procurement
+                WHERE configid = %s AND datasetid = %s AND runid = %s AND period IN %s AND ABS(solutionvalue) > %s
+            ) AS results_procurement
+            ORDER BY CAST(period AS int) {sorting}
+        """, (configid, datasetid, runid, period, threshold)),
+        'optimizer_storage': (f"""
+            SELECT *
+            FROM (
+                SELECT DISTINCT location, product, initialstock, period, cost, coefficient
+                FROM optimizer_storage
+                WHERE datasetid = %s AND period IN %s
+            ) AS storage
+            ORDER BY CAST(period AS int) {sorting}
+        """, (datasetid, period)),
+        'results_stock': (f"""
+            SELECT *
+            FROM (
+                SELECT DISTINCT location, product, period, solutionvalue
+                FROM results_stock
+                WHERE configid = %s AND datasetid = %s AND runid = %s AND period IN %s
+            ) AS results_stock
+            ORDER BY CAST(period AS int) {sorting}
+        """, (configid, datasetid, runid, period)),
+        'optimizer_demand': (f"""
+            SELECT *
+            FROM (
+                SELECT DISTINCT location, product, client, quantity, price, period
+                FROM optimizer_demand
+                WHERE datasetid = %s AND period IN %s AND ABS(quantity) > %s
+            ) AS demand
+            ORDER BY CAST(period AS int) {sorting}
+        """, (datasetid, period, threshold)),
+        'results_sale': (f"""
+            SELECT *
+            FROM (
+                SELECT DISTINCT location, product, client, solutionvalue, period
+                FROM results_sale
+                WHERE configid = %s AND datasetid = %s AND runid = %s AND period IN %s AND ABS(solutionvalue) > %s
+            ) AS results_sale
+            ORDER BY CAST(period AS int) {sorting}
+        """, (configid, datasetid, runid, period, threshold)),
+        'optimizer_bom': (f"""
+            SELECT *
+            FROM (
+                SELECT DISTINCT bomnum, location, product, input_output, period
+                FROM optimizer_bom
+                WHERE datasetid = %s AND period IN %s
+            ) AS bom
+            ORDER BY CAST(period AS int) {sorting}
+        """, (datasetid, period)),
+    }
+
+    return queries
+
+
+def read_table(connection_pool, query, params, load_method='fetch', numeric_mode='decimal'):
+    """ Reads the result of the query on a connection of the pool """
+    conn = connection_pool.getconn()
+    try:
+        # the rows of a named cursor stay on the server until they are fetched
+        if load_method == 'stream':
+            cursor = conn.cursor(name='resource_mapper_stream')
+        else:
+            cursor = conn.cursor()
+        # the rows of a named cursor belong to the transaction, so it is closed before the commit
+        with cursor:
+            df = read_query(cursor, query, params, load_method, numeric_mode)
+        conn.commit()
+    finally:
+        connection_pool.putconn(conn)
+    return df
+
+
+def read_tables(queries, load_method='fetch', numeric_mode='decimal', connections=1):
+    """
+    Reads the results of the independent queries concurrently, each on its own pooled connection
+    :param queries: dict, query and its parameters of each table
+    :param connections: int, number of queries run at the same time
+    :return: dict, pd.DataFrame of each table
+    """
+    connection_pool = get_connection_pool(connections)
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        futures = {
+            table: executor.submit(read_table, connection_pool, query, params, load_method, numeric_mode)
+            for table, (query, params) in queries.items()
+        }
+        return {table: future.result() for table, future in futures.items()}
+
+
+def data_loader(configid, datasetid, runid, period, time_direction, priority, lead_time=True,
+                numeric_mode='decimal', load_method='fetch', connections=1, categoricals=False):
+    """
+    Loads the optimizer data and results and prepares them for mapping.
+    In the 'decimal' numeric mode the quantities are Decimal objects as returned by psycopg2,
+    in the 'float' mode they are converted into float64. Float results match the Decimal ones within
+    an absolute tolerance of 1e-6 on volumes and costs, unless a residual falls within that tolerance of the threshold.
+    The 'fetch' load method fetches the rows of each query into Python tuples,
+    the 'copy' method streams them with COPY ... TO STDOUT and parses them column-wise,
+    the 'stream' method reads them in batches from a server-side cursor.
+    The tables are read concurrently on up to the given number of pooled connections.
+    With categoricals, the entity columns are pandas categoricals sharing one set of categories per entity
+    :return: tuple of pd.DataFrames
+             (df_results_sale, df_results_stock, df_results_production, df_results_movement, df_results_procurement,
+              df_bom, df_capacity, df_demand)
+    """
+    # read the tables from the database
+    queries = build_queries(configid, datasetid, runid, period, get_sorting(time_direction), config.threshold)
+    tables = read_tables(queries, load_method, numeric_mode, connections)
+
+    return prepare_tables(tables, time_direction, priority, lead_time, numeric_mode, categoricals)
+
+
+def prepare_tables(tables, time_direction, priority, lead_time=True, numeric_mode='decimal', categoricals=False):
+    """
+    Prepares the tables read from the database for mapping
+    :param tables: dict, pd.DataFrame of each queried table, as returned by read_tables
+    :return: tuple of pd.DataFrames
+             (df_results_sale, df_results_stock, df_results_production, df_results_movement, df_results_procurement,
+              df_bom, df_capacity, df_demand)
+    """
     # Optimizer Production
-    # Query the products from the optimizer_production table
-    cursor.execute(f"""
-        SELECT *
-        FROM optimizer_production
-        WHERE datasetid = {datasetid} AND period IN {period}
-        ORDER BY CAST(period AS int) {sorting}
-    """)
-    production_rows = cursor.fetchall()
-    # Save the results in a DataFrame
-    df_production = pd.DataFrame(production_rows,
-                                 columns=[desc[0] for desc in cursor.description])
+    # Drop the capacity columns
+    production_cols = ['location', 'product', 'bomnum', 'period', 'duration', 'cost', 'coefficient']
+    df_production = tables['optimizer_production'][production_cols].drop_duplicates().copy()
     # Cast integer datatypes
     df_production['period'] = df_production['period'].astype(int)
     df_production['duration'] = df_production['duration'].astype(int)
-    # Drop unnecessary columns
-    production_cols = ['location', 'product', 'bomnum', 'period', 'duration', 'cost', 'coefficient']
-    df_production = df_production[production_cols].copy()
-
-    # Drop duplicates
-    df_production = df_production.drop_duplicates()
 
     # Results Production
     # Query the products from the results_production table
-    cursor.execute(f"""
-        SELECT *
-        FROM results_production
-        WHERE configid = {configid} AND datasetid = {datasetid} AND runid = {runid} AND period IN {period}
-        ORDER BY CAST(period AS int) {sorting}
-    """)
-    results_production_rows = cursor.fetchall()
-    # Save the results in a DataFrame
-    df_results_production = pd.DataFrame(results_production_rows, columns=[desc[0] for desc in cursor.description])
-    # Filter out numbers close to zero
-    df_results_production = df_results_production[
-        abs(df_results_production['solutionvalue']) > config.threshold]
+    # Numbers close to zero are filtered out
+    df_results_production = tables['results_production']
     # Cast integer datatypes
     df_results_production['period'] = df_results_production['period'].astype(int)
-    # Drop unnecessary columns
-    results_production_cols = ['location', 'product', 'bomnum', 'period', 'solutionvalue']
-    df_results_production = df_results_production[results_production_cols].copy()
-    # Drop duplicates
-    df_results_production = df_results_production.drop_duplicates()
 
     # Merge Production with Lead time
     df_results_production = pd.merge(df_results_production, df_production,
@@ -66,60 +445,22 @@ def data_loader(configid, datasetid, runid, period, time_direction, priority, le
     df_results_production = df_results_production.rename(columns={'duration': 'leadtime'})
 
     # Optimizer Capacity
-    # Query the products from the optimizer_production table
-    cursor.execute(f"""
-        SELECT *
-        FROM optimizer_production
-        WHERE datasetid = {datasetid} AND period IN {period}
-    """)
-    capacity_rows = cursor.fetchall()
-    # Save the results in a DataFrame
-    df_capacity = pd.DataFrame(capacity_rows, columns=[desc[0] for desc in cursor.description])
+    # Drop the lead time and cost columns
+    capacity_cols = ['location', 'product', 'bomnum', 'period', 'resource', 'capacity', 'var_production_cons']
+    df_capacity = tables['optimizer_production'][capacity_cols].drop_duplicates().copy()
     # Cast integer datatypes
     df_capacity['period'] = df_capacity['period'].astype(int)
-    # Drop unnecessary columns
-    capacity_cols = ['location', 'product', 'bomnum', 'period', 'resource', 'capacity', 'var_production_cons']
-    df_capacity = df_capacity[capacity_cols].copy()
-    # Drop duplicates
-    df_capacity = df_capacity.drop_duplicates()
 
     # Optimizer Transportation
     # Query the products from the optimizer_transportation table
-    cursor.execute(f"""
-        SELECT *
-        FROM optimizer_transportation
-        WHERE datasetid = {datasetid} AND period IN {period}
-    """)
-    movement_rows = cursor.fetchall()
-    # Save the results in a DataFrame
-    df_movement = pd.DataFrame(movement_rows, columns=[desc[0] for desc in cursor.description])
+    df_movement = tables['optimizer_transportation']
     # Cast integers
     df_movement['duration'] = df_movement['duration'].astype(int)
-    # Drop unnecessary columns
-    movement_cols = ['loc_from', 'loc_to', 'product', 'period', 'transport_type', 'duration', 'cost', 'coefficient']
-    df_movement = df_movement[movement_cols].copy()
-    # Drop duplicates
-    df_movement = df_movement.drop_duplicates()
 
     # Results Movements
     # Query the products from the results_movement table
-    cursor.execute(f"""
-        SELECT *
-        FROM results_movement
-        WHERE configid = {configid} AND datasetid = {datasetid} AND runid = {runid} AND period IN {period}
-        ORDER BY CAST(period AS int) {sorting}
-    """)
-    results_movement_rows = cursor.fetchall()
-    # Save the results in a DataFrame
-    df_results_movement = pd.DataFrame(results_movement_rows, columns=[desc[0] for desc in cursor.description])
-    # Filter out numbers close to zero
-    df_results_movement = df_results_movement[
-        abs(df_results_movement['solutionvalue']) > config.threshold]
-    # Drop unnecessary columns
-    df_results_movement_cols = ['loc_from', 'loc_to', 'product', 'period', 'solutionvalue', 'transport_type']
-    df_results_movement = df_results_movement[df_results_movement_cols].copy()
-    # Drop duplicates
-    df_results_movement = df_results_movement.drop_duplicates()
+    # Numbers close to zero are filtered out
+    df_results_movement = tables['results_movement']
 
     # Merge result movement with lead times and cost
     df_results_movement = pd.merge(df_results_movement, df_movement,
@@ -129,40 +470,12 @@ def data_loader(configid, datasetid, runid, period, time_direction, priority, le
 
     # Optimizer Procurement
     # Query the products from the optimiier_procurement table
-    cursor.execute(f"""
-        SELECT *
-        FROM optimizer_procurement
-        WHERE datasetid = {datasetid} AND period IN {period}
-        ORDER BY CAST(period AS int) {sorting}
-    """)
-    procurement_rows = cursor.fetchall()
-
-    # Save the results in a DataFrame
-    df_procurement = pd.DataFrame(procurement_rows, columns=[desc[0] for desc in cursor.description])
-    # Drop unnecessary columns
-    procurement_cols = ['location', 'product', 'period', 'supplier', 'cost', 'coefficient']
-    df_procurement = df_procurement[procurement_cols].copy()
-    # Drop duplicates
-    df_procurement = df_procurement.drop_duplicates()
+    df_procurement = tables['optimizer_procurement']
 
     # Results Procurement
     # Query the products from the results_procurement table
-    cursor.execute(f"""
-        SELECT *
-        FROM results_procurement
-        WHERE configid = {configid} AND datasetid = {datasetid} AND runid = {runid} AND period IN {period}
-        ORDER BY CAST(period AS int) {sorting}
-    """)
-    results_procurement_rows = cursor.fetchall()
-    # Save the results in a DataFrame
-    df_results_procurement = pd.DataFrame(results_procurement_rows, columns=[desc[0] for desc in cursor.description])
-    # Filter out values close to zero
-    df_results_procurement = df_results_procurement[abs(df_results_procurement['solutionvalue']) > config.threshold]
-    # Drop unnecessary columns
-    df_results_procurement_cols = ['location', 'product', 'period', 'solutionvalue', 'supplier']
-    df_results_procurement = df_results_procurement[df_results_procurement_cols].copy()
-    # Drop duplicates
-    df_results_procurement = df_results_procurement.drop_duplicates()
+    # Values close to zero are filtered out
+    df_results_procurement = tables['results_procurement']
 
     # Merge result procurement with cost
     df_results_procurement = pd.merge(df_results_procurement, df_procurement,
@@ -170,37 +483,11 @@ def data_loader(configid, datasetid, runid, period, time_direction, priority, le
 
     # Initial Stock and Cost
     # Execute the query to retrieve stock data
-    cursor.execute(f"""
-           SELECT *
-           FROM optimizer_storage
-           WHERE datasetid = {datasetid} AND period IN {period}
-           ORDER BY CAST(period AS int) {sorting}
-       """)
-    stock_rows = cursor.fetchall()
-    # Save the results in a DataFrame
-    df_stock = pd.DataFrame(stock_rows, columns=[desc[0] for desc in cursor.description])
-    # Drop unnecessary columns
-    initial_stock_cols = ['location', 'product', 'initialstock', 'period', 'cost', 'coefficient']
-    df_stock = df_stock[initial_stock_cols].copy()
-    # Drop duplicates
-    df_stock = df_stock.drop_duplicates()
+    df_stock = tables['optimizer_storage']
 
     # Results Stock
     # Query the products from the results_production table
-    cursor.execute(f"""
-        SELECT *
-        FROM results_stock
-        WHERE configid = {configid} AND datasetid = {datasetid} AND runid = {runid} AND period IN {period}
-        ORDER BY CAST(period AS int) {sorting}
-    """)
-    results_stock_rows = cursor.fetchall()
-    # Save the results in a DataFrame
-    df_results_stock = pd.DataFrame(results_stock_rows, columns=[desc[0] for desc in cursor.description])
-    # Drop unnecessary columns
-    df_results_stock_cols = ['location', 'product', 'period', 'solutionvalue']
-    df_results_stock = df_results_stock[df_results_stock_cols].copy()
-    # Drop duplicates
-    df_results_stock = df_results_stock.drop_duplicates()
+    df_results_stock = tables['results_stock']
 
     # Merge result stock with initial stock
     df_results_stock = pd.merge(df_results_stock, df_stock, on=['location', 'product', 'period'], how='left').fillna(0)
@@ -222,41 +509,13 @@ def data_loader(configid, datasetid, runid, period, time_direction, priority, le
     df_results_stock['period_spent'] = np.maximum(0, df_results_stock['period_spent'])
 
     # Execute the query to retrieve demands
-    cursor.execute(f"""
-        SELECT *
-        FROM optimizer_demand
-        WHERE datasetid = {datasetid} AND period IN {period}
-        ORDER BY CAST(period AS int) {sorting}
-    """)
-    demand_rows = cursor.fetchall()
-    # Save the results in a DataFrame
-    df_demand = pd.DataFrame(demand_rows, columns=[desc[0] for desc in cursor.description])
-    # Filter out values close to zero
-    df_demand = df_demand[abs(df_demand['quantity']) > config.threshold]
-    # Drop unnecessary columns
-    demand_cols = ['location', 'product', 'client', 'quantity', 'price', 'period']
-    df_demand = df_demand[demand_cols].copy()
-    # Drop duplicates
-    df_demand = df_demand.drop_duplicates()
+    # Values close to zero are filtered out
+    df_demand = tables['optimizer_demand']
 
     # Results Sales
     # Execute the query to retrieve sales
-    cursor.execute(f"""
-        SELECT *
-        FROM results_sale
-        WHERE configid = {configid} AND datasetid = {datasetid} AND runid = {runid} AND period IN {period}
-        ORDER BY CAST(period AS int) {sorting}
-    """)
-    sale_rows = cursor.fetchall()
-    # Save the results in a DataFrame
-    df_results_sale = pd.DataFrame(sale_rows, columns=[desc[0] for desc in cursor.description])
-    # Filter out values close to zero
-    df_results_sale = df_results_sale[abs(df_results_sale['solutionvalue']) > config.threshold]
-    # Drop unnecessary columns
-    results_sale_cols = ['location', 'product', 'client', 'solutionvalue', 'period']
-    df_results_sale = df_results_sale[results_sale_cols].copy()
-    # Drop duplicates and reset index
-    df_results_sale = df_results_sale.drop_duplicates().reset_index(drop=True)
+    # Values close to zero are filtered out
+    df_results_sale = tables['results_sale']
 
     # Merge sales with demand
     df_results_sale = pd.merge(df_results_sale, df_demand, on=['location', 'product', 'client', 'period'])
@@ -265,25 +524,7 @@ def data_loader(configid, datasetid, runid, period, time_direction, priority, le
     df_results_sale['revenue'] = df_results_sale['solutionvalue'] * df_results_sale['price']
 
     # Execute the query to retrieve BOMs
-    cursor.execute(f"""
-        SELECT *
-        FROM optimizer_bom
-        WHERE datasetid = {datasetid} AND period IN {period}
-        ORDER BY CAST(period AS int) {sorting}
-    """)
-    bom_rows = cursor.fetchall()
-    # Save the results in a DataFrame
-    df_bom = pd.DataFrame(bom_rows, columns=[desc[0] for desc in cursor.description])
-    # Drop unnecessary columns
-    df_bom_cols = ['bomnum', 'location', 'product', 'input_output', 'period']
-    df_bom = df_bom[df_bom_cols].copy()
-    # Drop duplicates
-    df_bom = df_bom.drop_duplicates()
-
-    # Close the cursor and the database connection
-    conn.commit()
-    cursor.close()
-    conn.close()
+    df_bom = tables['optimizer_bom']
 
     # Parameters
     # Sorting parameters
@@ -326,16 +567,12 @@ def data_loader(configid, datasetid, runid, period, time_direction, priority, le
     df_results_movement = df_results_movement.assign(operation_type='movement')
 
     # Create unique keys
-    df_results_sale['keys'] = df_results_sale.apply(
-        lambda row: '.'.join(row[['client', 'period', 'location', 'product']].astype(str)), axis=1)
-    df_results_production['keys'] = df_results_production.apply(
-        lambda row: '.'.join(row[['location', 'period', 'product', 'bomnum']].astype(str)), axis=1)
-    df_results_stock['keys'] = df_results_stock.apply(
-        lambda row: '.'.join(row[['location', 'period', 'product']].astype(str)), axis=1)
-    df_results_movement['keys'] = df_results_movement.apply(
-        lambda row: '.'.join(row[['loc_to', 'loc_from', 'product', 'period', 'transport_type']].astype(str)), axis=1)
-    df_results_procurement['keys'] = df_results_procurement.apply(
-        lambda row: '.'.join(row[['product', 'supplier', 'period']].astype(str)), axis=1)
+    df_results_sale['keys'] = build_keys(df_results_sale, ['client', 'period', 'location', 'product'])
+    df_results_production['keys'] = build_keys(df_results_production, ['location', 'period', 'product', 'bomnum'])
+    df_results_stock['keys'] = build_keys(df_results_stock, ['location', 'period', 'product'])
+    df_results_movement['keys'] = build_keys(df_results_movement,
+                                             ['loc_to', 'loc_from', 'product', 'period', 'transport_type'])
+    df_results_procurement['keys'] = build_keys(df_results_procurement, ['product', 'supplier', 'period'])
 
     # Initialize residuals counting
     df_results_sale['residual'] = df_results_sale['solutionvalue']
@@ -350,4 +587,23 @@ def data_loader(configid, datasetid, runid, period, time_direction, priority, le
     df_results_procurement['leftover'] = df_results_procurement['solutionvalue']
     df_capacity['leftover'] = df_capacity['capacity']
 
+    # Convert the quantities into the numeric mode
+    df_results_sale = convert_quantities(df_results_sale, 'sales', numeric_mode)
+    df_results_stock = convert_quantities(df_results_stock, 'stock', numeric_mode)
+    df_results_production = convert_quantities(df_results_production, 'production', numeric_mode)
+    df_results_movement = convert_quantities(df_results_movement, 'movement', numeric_mode)
+    df_results_procurement = convert_quantities(df_results_procurement, 'procurement', numeric_mode)
+    df_bom = convert_quantities(df_bom, 'bom', numeric_mode)
+    df_capacity = convert_quantities(df_capacity, 'capacity', numeric_mode)
+    df_demand = convert_quantities(df_demand, 'demand', numeric_mode)
+
+    # Share the categories of the entity columns across the frames
+    frames = [df_results_sale, df_results_stock, df_results_production, df_results_movement, df_results_procurement,
+              df_bom, df_capacity, df_demand]
+    if categoricals:
+        dtypes = build_entity_dtypes(frames)
+        frames = [to_categoricals(df, dtypes) for df in frames]
+    df_results_sale, df_results_stock, df_results_production, df_results_movement, df_results_procurement, df_bom, \
+        df_capacity, df_demand = frames
+
     return df_results_sale, df_results_stock, df_results_production, df_results_movement, df_results_procurement, df_bom, df_capacity, df_demand
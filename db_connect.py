@@ -1,9 +1,15 @@
+import atexit
 import os
 from dotenv import load_dotenv
 import psycopg2
+from psycopg2 import pool
 
 
-def db_connect():
+# connections shared by the loaders of a process
+connection_pool = None
+
+
+def get_db_params():
     # Load environment variables from .env file
     load_dotenv()
 
@@ -16,7 +22,42 @@ def db_connect():
         'password': os.getenv('DB_PASSWORD'),
     }
 
+    return db_params
+
+
+def db_connect():
     # Connect to the database
-    conn = psycopg2.connect(**db_params)
+    conn = psycopg2.connect(**get_db_params())
 
     return conn
+
+
+def get_connection_pool(connections=1):
+    """
+    Returns the thread-safe pool of database connections of the process, the pool is created on the first call.
+    The connections are kept open between loads and closed at exit
+    :param connections: int, maximum number of connections of the pool
+    :return: psycopg2.pool.ThreadedConnectionPool
+    """
+    global connection_pool
+
+    # recreate the pool if more connections are needed
+    if connection_pool is not None and connection_pool.maxconn < connections:
+        close_connection_pool()
+
+    if connection_pool is None:
+        connection_pool = pool.ThreadedConnectionPool(1, connections, **get_db_params())
+
+    return connection_pool
+
+
+def close_connection_pool():
+    """ Closes all connections of the pool """
+    global connection_pool
+
+    if connection_pool is not None:
+        connection_pool.closeall()
+        connection_pool = None
+
+
+atexit.register(close_connection_pool)
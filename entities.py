@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+
+# columns holding the names of each entity encoded for the mapping
+ENTITY_COLUMNS = {
+    'location': ['location', 'loc_from', 'loc_to'],
+    'product': ['product'],
+    'client': ['client'],
+    'supplier': ['supplier'],
+    'bomnum': ['bomnum'],
+    'transport_type': ['transport_type'],
+}
+
+
+def build_entity_dictionary(inputs, previous_entities=None):
+    """
+    Creates the dictionary of the names of each entity, the code of a name is its position in the dictionary.
+    The names of the previous dictionary keep their codes and the new names are appended,
+    so that the mapping of a previous run can be compared with the current one on the codes
+    :param inputs: tuple of pd.DataFrames returned by data_loader
+    :param previous_entities: dict, dictionary of the entities of the previous run
+    :return: dict, pd.Index of the names of each entity, and under 'dtypes' the dtype of each entity column
+             in the first input frame holding it, which the decoded columns get back
+    """
+    entities = {'dtypes': {}}
+    for entity, columns in ENTITY_COLUMNS.items():
+        names = set()
+        for df in inputs:
+            for column in columns:
+                if column in df.columns:
+                    names.update(df[column].dropna())
+                    entities['dtypes'].setdefault(column, df[column].dtype)
+        previous_names = previous_entities[entity] if previous_entities is not None else pd.Index([])
+        new_names = sorted(names.difference(previous_names), key=str)
+        entities[entity] = previous_names.append(pd.Index(new_names, dtype=object))
+    return entities
+
+
+def encode_entities(df, entities):
+    """ Replaces the names in the entity columns of the DataFrame with their integer codes, missing names are -1 """
+    df = df.copy()
+    for entity, columns in ENTITY_COLUMNS.items():
+        for column in columns:
+            if column in df.columns:
+                df[column] = entities[entity].get_indexer(df[column].astype(object))
+    return df
+
+
+def encode_inputs(inputs, entities):
+    """
+    Encodes the entity columns of the frames read by the mapper, the demands keep their names
+    :return: tuple of pd.DataFrames in the order of data_loader
+    """
+    *frames, df_demand = inputs
+    return (*[encode_entities(df, entities) for df in frames], df_demand)
+
+
+def decode_entities(df, entities):
+    """
+    Replaces the integer codes in the entity columns of the DataFrame with the names of the entities,
+    in the dtype of the column in the inputs, a column with missing names keeps them as NaN
+    :return: pd.DataFrame with the names of the entities
+    """
+    df = df.copy()
+    for entity, columns in ENTITY_COLUMNS.items():
+        for column in columns:
+            if column in df.columns:
+                codes = df[column].to_numpy(dtype=np.int64)
+                names = pd.Categorical.from_codes(codes, categories=entities[entity])
+                dtype = entities['dtypes'].get(column, np.dtype(object))
+                if isinstance(dtype, pd.CategoricalDtype):
+                    df[column] = pd.Series(names, index=df.index).astype(dtype)
+                else:
+                    values = np.asarray(names, dtype=object)
+                    df[column] = values.astype(dtype) if (codes >= 0).all() else values
+    return df
@@ -0,0 +1,327 @@
+import os
+import pickle
+import time
+from bisect import bisect_left
+
+from tqdm import tqdm
+
+from bom_index import build_bom_index
+from candidate_index import build_candidate_index, update_candidate
+from instrumentation import build_order_stats
+from mapped_records import build_mapped_records, append_mapped_sale, index_last_rows
+from resource_mapper import map_resources, map_sales
+from resource_state import build_resource_state, LEFTOVER_COLUMNS
+
+
+# columns which identify the same row in the inputs of different runs
+IDENTITY_COLUMNS = {
+    'sales': ['client', 'location', 'product', 'period'],
+    'stock': ['location', 'product', 'period'],
+    'production': ['location', 'product', 'bomnum', 'period'],
+    'movement': ['loc_from', 'loc_to', 'product', 'period', 'transport_type'],
+    'procurement': ['location', 'product', 'period', 'supplier'],
+    'bom': ['bomnum', 'location', 'product', 'period'],
+    'capacity': ['location', 'product', 'bomnum', 'period', 'resource'],
+}
+
+# resource tables whose leftovers decide the allocations, they are looked up by (product, loc_to)
+ALLOCATED_TABLES = ['stock', 'production', 'movement', 'procurement']
+
+# frames returned by data_loader, in their order
+INPUT_TABLES = ['sales', 'stock', 'production', 'movement', 'procurement', 'bom', 'capacity', 'demand']
+
+
+def get_identities(df, table):
+    """
+    Returns the identity of every row of the table.
+    Rows with the same identity columns, like the productions merged with several costs, are told apart
+    by their occurrence in the order of the table
+    """
+    occurrences = {}
+    identities = []
+    for values in zip(*[df[column] for column in IDENTITY_COLUMNS[table]]):
+        occurrence = occurrences.get(values, 0)
+        occurrences[values] = occurrence + 1
+        identities.append(values + (occurrence,))
+    return identities
+
+
+def get_row_values(df):
+    """ Returns the values of every row of the table, missing values are None so that equal rows compare equal """
+    return list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+
+def find_changed_rows(df_previous, df, table):
+    """
+    Compares the rows of the table in the previous and the current inputs
+    :return: set, identities of the added, removed and changed rows
+    """
+    previous_rows = dict(zip(get_identities(df_previous, table), get_row_values(df_previous)))
+    rows = dict(zip(get_identities(df, table), get_row_values(df)))
+    return {identity for identity in previous_rows.keys() | rows.keys()
+            if previous_rows.get(identity) != rows.get(identity)}
+
+
+def build_mapping_snapshot(inputs, mapped_records, traces, threshold, map_priority, entities=None):
+    """
+    Keeps what an incremental run needs from a mapped run
+    :param inputs: tuple of pd.DataFrames read by the mapper, before the leftovers are written back
+    :param mapped_records: dict, mapped rows of all orders
+    :param traces: dict, lookups and resource updates of each order_id
+    :param threshold: Decimal or float, threshold of the run
+    :param map_priority: dict, priority of resources of the run
+    :param entities: dict, dictionary of the entities encoded in the inputs
+    :return: dict, snapshot of the mapping
+    """
+    return {
+        'inputs': dict(zip(INPUT_TABLES, inputs)),
+        'mapped_records': mapped_records,
+        'traces': traces,
+        'threshold': threshold,
+        'map_priority': map_priority,
+        'entities': entities,
+    }
+
+
+def save_mapping(mapping_dir, key, snapshot):
+    """ Saves the snapshot of the mapping of the run with the key """
+    os.makedirs(mapping_dir, exist_ok=True)
+    with open(os.path.join(mapping_dir, f'{key}.pkl'), 'wb') as file:
+        pickle.dump(snapshot, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_mapping(mapping_dir, key):
+    """ Loads the snapshot of the mapping of the run with the key, None if the run was not saved """
+    path = os.path.join(mapping_dir, f'{key}.pkl')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+
+def split_mapped_rows(mapped_records):
+    """ Groups the mapped rows of every table by their order_id, keeping the mapping order """
+    order_rows = {}
+    for table, records in mapped_records.items():
+        if table == 'sales':
+            continue
+        order_id_position = records['columns'].get_loc('order_id')
+        for row in records['rows']:
+            order_rows.setdefault(row[order_id_position], {}).setdefault(table, []).append(row)
+    return order_rows
+
+
+def remap_sales(previous_mapping, df_sales, df_stock, df_production, df_movement, df_procurement, df_bom,
+                df_capacity, map_priority, threshold, engine='recursive', verbose=True, traces=None, stats=None):
+    """
+    Maps the sales reusing the mapping of a previous run whose inputs differ in a part of the rows.
+    An order keeps its previous allocations if its sale did not change and every resource row at the locations
+    it looked up is unchanged and has the same leftovers as when the order was mapped in the previous run.
+    The allocations of such orders are replayed, the other orders are mapped again in the order of df_sales,
+    so the result is the same as of map_sales
+    :param previous_mapping: dict, snapshot of the mapping of the previous run
+    :param engine: str, 'recursive' or 'iterative' mapping engine
+    :param verbose: bool, whether to show the progress of the mapping
+    :param traces: dict, collects the lookups and the resource updates of each order_id
+    :param stats: dict, collects the counters of each order_id mapped again, the replayed orders are not counted
+    :return: tuple of dicts: mapped rows and leftovers of the resources (mapped_records, resource_state)
+    """
+    # the allocations depend on the threshold and the priorities, so they can only be reused with the same ones
+    if previous_mapping['threshold'] != threshold or previous_mapping['map_priority'] != map_priority:
+        return map_sales(df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity,
+                         map_priority, threshold, engine, verbose, traces, stats)
+    if traces is None:
+        traces = {}
+
+    frames = {
+        'sales': df_sales,
+        'stock': df_stock,
+        'production': df_production,
+        'movement': df_movement,
+        'procurement': df_procurement,
+        'bom': df_bom,
+        'capacity': df_capacity,
+    }
+    previous_frames = previous_mapping['inputs']
+    previous_records = previous_mapping['mapped_records']
+    previous_traces = previous_mapping['traces']
+
+    # find the changed rows of the inputs
+    changed_rows = {table: find_changed_rows(previous_frames[table], df, table) for table, df in frames.items()}
+
+    # locations of the allocated resources which were added, removed, changed or whose rows are in another order,
+    # as the allocations follow the order of the candidate rows
+    changed_nodes = set()
+    for table in ALLOCATED_TABLES:
+        node_identities = []
+        for df in (previous_frames[table], frames[table]):
+            identities = {}
+            for identity, node in zip(get_identities(df, table), zip(df['product'], df['loc_to'])):
+                identities.setdefault(node, []).append(identity)
+                if identity in changed_rows[table]:
+                    changed_nodes.add(node)
+            node_identities.append(identities)
+        previous_node_identities, current_node_identities = node_identities
+        changed_nodes.update(node for node in previous_node_identities.keys() | current_node_identities.keys()
+                             if previous_node_identities.get(node) != current_node_identities.get(node))
+
+    # BOMs whose inputs or capacities changed
+    changed_boms = {identity[0] for identity in changed_rows['bom']} | \
+                   {identity[2] for identity in changed_rows['capacity']}
+
+    # row positions of the current resources
+    positions = {table: {identity: position for position, identity in enumerate(get_identities(frames[table], table))}
+                 for table in ALLOCATED_TABLES + ['capacity']}
+    node_rows = {}
+    for table in ALLOCATED_TABLES:
+        df = frames[table]
+        for position, (identity, node) in enumerate(zip(get_identities(df, table), zip(df['product'], df['loc_to']))):
+            node_rows.setdefault(node, []).append((table, identity, position))
+
+    # previous orders by their sale, and the rank of the previous orders
+    previous_sales = previous_frames['sales']
+    previous_orders = dict(zip(get_identities(previous_sales, 'sales'), previous_sales.index))
+    previous_rank = {order_id: rank for rank, order_id in enumerate(previous_sales.index)}
+    previous_order_rows = split_mapped_rows(previous_records)
+    previous_sale_rows = dict(zip(previous_records['sales']['index'], previous_records['sales']['rows']))
+
+    # identities of the previous resource rows, which are traced by their labels
+    previous_identities = {table: dict(zip(previous_frames[table].index, get_identities(previous_frames[table], table)))
+                           for table in ALLOCATED_TABLES + ['capacity']}
+
+    # leftovers of the resources in the previous run: the initial ones and the ones after every allocating order
+    previous_initial = {}
+    previous_updates = {table: {} for table in ALLOCATED_TABLES}
+    for table in ALLOCATED_TABLES:
+        df = previous_frames[table]
+        columns = LEFTOVER_COLUMNS[table]
+        previous_initial[table] = dict(zip(get_identities(df, table), zip(*[df[column] for column in columns])))
+    for rank, order_id in enumerate(previous_sales.index):
+        for table, name, leftover in previous_traces[order_id]['updates']:
+            ranks, leftovers = previous_updates[table].setdefault(previous_identities[table][name], ([], []))
+            # the last update of the order holds the leftovers after the order
+            if ranks and ranks[-1] == rank:
+                leftovers[-1] = leftover
+            else:
+                ranks.append(rank)
+                leftovers.append(leftover)
+
+    def get_previous_leftover(table, identity, rank):
+        # leftovers of the resource when the order of the rank was mapped in the previous run
+        ranks, leftovers = previous_updates[table].get(identity, ([], []))
+        i = bisect_left(ranks, rank)
+        return leftovers[i - 1] if i > 0 else previous_initial[table][identity]
+
+    # index the candidate resources and keep their leftovers during the mapping
+    candidate_index = build_candidate_index(df_stock, df_production, df_movement, df_procurement, threshold)
+    bom_index = build_bom_index(df_bom, df_capacity)
+    resource_state = build_resource_state(df_stock, df_production, df_movement, df_procurement, df_capacity)
+    mapped_records = build_mapped_records(df_sales, df_stock, df_production, df_movement, df_procurement, df_capacity)
+
+    def is_clean(sale_identity):
+        # check that the order would allocate the same resources as in the previous run
+        if sale_identity in changed_rows['sales'] or sale_identity not in previous_orders:
+            return False
+        previous_order_id = previous_orders[sale_identity]
+        nodes = previous_traces[previous_order_id]['lookups']
+        if not nodes.isdisjoint(changed_nodes):
+            return False
+        production_records = previous_order_rows.get(previous_order_id, {}).get('production', [])
+        bomnum_position = previous_records['production']['columns'].get_loc('bomnum')
+        if any(row[bomnum_position] in changed_boms for row in production_records):
+            return False
+        rank = previous_rank[previous_order_id]
+        for node in nodes:
+            for table, identity, position in node_rows.get(node, []):
+                leftover = tuple(resource_state[table][column][position] for column in LEFTOVER_COLUMNS[table])
+                if leftover != get_previous_leftover(table, identity, rank):
+                    return False
+        return True
+
+    def replay_order(order_id, previous_order_id):
+        # apply the previous updates of the resources of the order, traced by the labels of the current rows
+        previous_trace = previous_traces[previous_order_id]
+        trace = {'lookups': set(previous_trace['lookups']), 'updates': [], 'capacity': []}
+        for table, name, leftover in previous_trace['updates']:
+            position = positions[table][previous_identities[table][name]]
+            for column, value in zip(LEFTOVER_COLUMNS[table], leftover):
+                resource_state[table][column][position] = value
+            if table == 'stock':
+                stock_leftover = dict(zip(LEFTOVER_COLUMNS['stock'], leftover))
+                update_candidate(candidate_index, 'stock_sv', position, stock_leftover['sv_leftover'], threshold)
+                update_candidate(candidate_index, 'stock_ps', position, stock_leftover['ps_leftover'], threshold)
+            else:
+                update_candidate(candidate_index, table, position, leftover[0], threshold)
+            trace['updates'].append((table, frames[table].index[position], leftover))
+
+        # append the previous mapped rows of the order
+        for table, rows in previous_order_rows.get(previous_order_id, {}).items():
+            records = mapped_records[table]
+            columns = records['columns']
+            order_id_position = columns.get_loc('order_id')
+            rows = [list(row) for row in rows]
+            for row in rows:
+                row[order_id_position] = order_id
+            records['rows'].extend(rows)
+            index_last_rows(records, rows)
+
+        # capacities do not decide the allocations, so the consumption of the mapped capacity rows is applied
+        # to the current leftovers
+        records = mapped_records['capacity']
+        capacity_count = len(previous_order_rows.get(previous_order_id, {}).get('capacity', []))
+        capacity_rows = records['rows'][len(records['rows']) - capacity_count:]
+        columns = records['columns']
+        for row, name in zip(capacity_rows, previous_trace['capacity']):
+            position = positions['capacity'][previous_identities['capacity'][name]]
+            leftover = resource_state['capacity']['leftover'][position] - \
+                row[columns.get_loc('resource_consumption_operation')]
+            resource_state['capacity']['leftover'][position] = leftover
+            row[columns.get_loc('leftover')] = leftover
+            trace['capacity'].append(frames['capacity'].index[position])
+
+        # append the mapped sale
+        sale_row = list(previous_sale_rows[previous_order_id])
+        sale_row[mapped_records['sales']['columns'].get_loc('order_id')] = order_id
+        mapped_records['sales']['rows'].append(sale_row)
+        mapped_records['sales']['index'].append(order_id)
+        traces[order_id] = trace
+
+    # Iterate over rows in sorted sales dataframe
+    remapped = 0
+    for sale_identity, sale in tqdm(zip(get_identities(df_sales, 'sales'), df_sales.iterrows()), total=len(df_sales),
+                                    disable=not verbose):
+        # get the order_id and the row of the sale
+        order_id, order = sale
+
+        # replay the order if its allocations are not affected by the changes
+        if is_clean(sale_identity):
+            replay_order(order_id, previous_orders[sale_identity])
+            continue
+
+        # name series with its index
+        order.name = order_id
+
+        # label
+        label = order['keys']
+
+        # run recursive mapping and update resources
+        order_stats = None
+        if stats is not None:
+            order_stats = stats[order_id] = build_order_stats(order_id, label)
+            start = time.perf_counter()
+        map_resources(order, order_id, label, df_stock, df_production, df_movement, df_procurement,
+                      map_priority, df_bom, df_capacity, threshold, candidate_index,
+                      resource_state, mapped_records, engine,
+                      traces.setdefault(order_id, {'lookups': set(), 'updates': [], 'capacity': []}), order_stats,
+                      bom_index)
+        if stats is not None:
+            order_stats['time']['total'] = time.perf_counter() - start
+        remapped += 1
+
+        # update mapped sales
+        append_mapped_sale(mapped_records, order, order_id)
+
+    if verbose:
+        print(f'\n{remapped} of {len(df_sales)} orders have been mapped again.')
+
+    return mapped_records, resource_state
@@ -0,0 +1,92 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+
+
+# frames returned by data_loader, in their order
+CACHED_FRAMES = ['sales', 'stock', 'production', 'movement', 'procurement', 'bom', 'capacity', 'demand']
+
+
+def cache_key(configid, datasetid, runid, period, time_direction, priority, lead_time, threshold, numeric_mode,
+              categoricals=False):
+    """
+    Creates the key of the loaded inputs of a run.
+    The threshold filters the loaded results, the numeric mode sets the type of the quantities
+    and categoricals the type of the entity columns, so they are part of the key
+    :return: str, hex digest of the identifiers
+    """
+    identity = (configid, datasetid, runid, tuple(period), time_direction, priority, bool(lead_time), str(threshold),
+                numeric_mode, bool(categoricals))
+    return hashlib.sha1(repr(identity).encode()).hexdigest()
+
+
+def get_entry_size(path):
+    """ Returns the size in bytes of the files of the cache entry """
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def read_cache(cache_dir, key):
+    """
+    Reads the frames of the key from the cache and marks the entry as recently used
+    :return: tuple of pd.DataFrames in the order of data_loader, or None if the key is not cached
+    """
+    path = os.path.join(cache_dir, key)
+    if not os.path.isdir(path):
+        return None
+
+    frames = tuple(pd.read_pickle(os.path.join(path, f'{frame}.pkl')) for frame in CACHED_FRAMES)
+
+    # the modification time of the entry orders the evictions
+    os.utime(path)
+
+    return frames
+
+
+def write_cache(cache_dir, key, frames, max_size):
+    """
+    Writes the frames of the key into the cache and evicts the least recently used entries above the size limit.
+    The entry is written into a temporary directory and renamed, so a partially written entry is never read
+    :param frames: tuple of pd.DataFrames in the order of data_loader
+    :param max_size: int, maximum size of the cache in bytes
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key)
+
+    # pickle keeps the Decimal quantities and the dtypes of the frames exactly
+    temp_path = tempfile.mkdtemp(prefix=f'.{key}.', dir=cache_dir)
+    for frame, df in zip(CACHED_FRAMES, frames):
+        df.to_pickle(os.path.join(temp_path, f'{frame}.pkl'))
+
+    # replace an existing entry of the key
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(temp_path, path)
+
+    evict_cache(cache_dir, max_size, keep=key)
+
+
+def evict_cache(cache_dir, max_size, keep=None):
+    """ Removes the least recently used entries, except the entry of the keep key, until the cache fits max_size """
+    entries = [entry for entry in os.scandir(cache_dir)
+               if entry.is_dir() and not entry.name.startswith('.') and entry.name != keep]
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    sizes = {entry.path: get_entry_size(entry.path) for entry in entries}
+
+    total_size = sum(sizes.values())
+    if keep is not None and os.path.isdir(os.path.join(cache_dir, keep)):
+        total_size += get_entry_size(os.path.join(cache_dir, keep))
+    for entry in entries:
+        if total_size <= max_size:
+            break
+        shutil.rmtree(entry.path, ignore_errors=True)
+        total_size -= sizes[entry.path]
+
+
+def invalidate_cache(cache_dir, key=None):
+    """ Removes the cached entry of the key, or the whole cache if no key is given """
+    if key is None:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    else:
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
@@ -0,0 +1,98 @@
+import csv
+import json
+import time
+
+
+# operation types of the candidate resources and of the allocations
+OPERATION_TYPES = ['stock', 'production', 'movement', 'procurement']
+
+
+def build_order_stats(order_id, label):
+    """
+    Creates the counters of the mapping of an order
+    :return: dict, counters of the order
+    """
+    return {
+        'order_id': order_id,
+        'label': label,
+        'orders': 0,
+        'depth': 0,
+        'max_depth': 0,
+        'candidates': {operation_type: 0 for operation_type in OPERATION_TYPES},
+        'allocations': {operation_type: 0 for operation_type in OPERATION_TYPES},
+        'time': {key: 0.0 for key in ['find_candidates'] + OPERATION_TYPES + ['bom', 'capacity', 'total']},
+    }
+
+
+def timed(order_stats, key, function, allocation=False):
+    """ Wraps the function to add its duration to the time of the key, and to count the allocation if required """
+    def wrapper(*args):
+        start = time.perf_counter()
+        result = function(*args)
+        order_stats['time'][key] += time.perf_counter() - start
+        if allocation:
+            order_stats['allocations'][key] += 1
+        return result
+    return wrapper
+
+
+def counted_candidates(order_stats, find_candidates):
+    """ Wraps find_candidates to count the found rows of each operation type and the time of the lookups """
+    def wrapper(order):
+        start = time.perf_counter()
+        df_list = find_candidates(order)
+        order_stats['time']['find_candidates'] += time.perf_counter() - start
+        for df in df_list:
+            order_stats['candidates'][df.iloc[0]['operation_type']] += len(df)
+        return df_list
+    return wrapper
+
+
+def tracked_depth(order_stats, allocate_order):
+    """ Wraps the allocation generator to count the mapped orders and the depth of the nested allocations """
+    def wrapper(order):
+        order_stats['orders'] += 1
+        order_stats['depth'] += 1
+        order_stats['max_depth'] = max(order_stats['max_depth'], order_stats['depth'])
+        try:
+            yield from allocate_order(order)
+        finally:
+            order_stats['depth'] -= 1
+    return wrapper
+
+
+def flatten_order_stats(order_stats):
+    """ Flattens the counters of an order into a row with a column per counter """
+    row = {}
+    for key, value in order_stats.items():
+        if key == 'depth':
+            continue
+        if isinstance(value, dict):
+            row.update({f'{key}_{name}': item for name, item in value.items()})
+        else:
+            row[key] = value
+    return row
+
+
+def to_json(value):
+    """ Converts the numpy scalars of the counters, like the order_ids, into their python values """
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+def export_stats(stats, filepath):
+    """
+    Exports the counters of the mapped orders as JSON or CSV, depending on the extension of the file
+    :param stats: dict, counters of each order_id
+    :param filepath: str, path of the .json or .csv file
+    """
+    rows = [{key: value for key, value in order_stats.items() if key != 'depth'} for order_stats in stats.values()]
+
+    if filepath.endswith('.csv'):
+        rows = [flatten_order_stats(order_stats) for order_stats in stats.values()]
+        with open(filepath, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0]) if rows else [])
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(filepath, 'w') as file:
+            json.dump(rows, file, indent=2, default=to_json)
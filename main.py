@@ -1,13 +1,22 @@
+import argparse
+import os
 import pandas as pd
-from tqdm import tqdm
-from resource_mapper import map_resources
+from resource_mapper import map_sales
+from partitioning import map_sales_parallel
+from resource_state import update_resource_frames
+from mapped_records import materialize_mapped_records
 import config
 import utils
-from data_loader import data_loader
+from data_loader import data_loader, get_threshold
+from input_cache import cache_key, read_cache, write_cache, invalidate_cache
+from incremental import build_mapping_snapshot, save_mapping, load_mapping, remap_sales
+from instrumentation import export_stats
+from entities import build_entity_dictionary, encode_inputs, decode_entities
+from checkpoint import remove_checkpoint
 
 
-def process_mapped_resources(mapped_resources, df_demand):
-    """ Calculates additional columns and creates the summary table """
+def process_mapped_resources(mapped_resources, df_demand, runid=None):
+    """ Calculates additional columns and creates the summary table of the run, config.runid if not given """
 
     # unpack the mapped resources
     mapped_sales, mapped_stock, mapped_production, mapped_movement, mapped_procurement, mapped_capacity = mapped_resources
@@ -23,7 +32,7 @@ def process_mapped_resources(mapped_resources, df_demand):
 
     summary_table['config_id'] = config.configid
     summary_table['dataset_id'] = config.datasetid
-    summary_table['run_id'] = config.runid
+    summary_table['run_id'] = config.runid if runid is None else runid
 
     summary_table = summary_table.rename(
         columns={
@@ -91,101 +100,54 @@ def calculate_cost(mapped_resources):
     """ Calculates the costs of the mapped results """
 
     # unpack the mapped resources
-    mapped_sales, mapped_stock, mapped_movement, mapped_procurement, mapped_production = mapped_resources
+    mapped_sales, mapped_stock, mapped_production, mapped_movement, mapped_procurement = mapped_resources
 
     # calculate total costs
-    mapped_stock['cost_of_allocated'] = -mapped_stock['cost'] * \
-                                        mapped_stock['order_operation_volume'] * \
-                                        mapped_stock['coefficient']
-
-    mapped_movement['cost_of_allocated'] = -mapped_movement['cost'] * \
-                                           mapped_movement['order_operation_volume'] * \
-                                           mapped_procurement['coefficient']
-
-    mapped_procurement['cost_of_allocated'] = -mapped_procurement['cost'] * \
-                                              mapped_procurement['order_operation_volume'] * \
-                                              mapped_procurement['coefficient']
-
-    mapped_production['cost_of_allocated'] = -mapped_production['cost'] * \
-                                             mapped_production['order_operation_volume'] * \
-                                             mapped_production['coefficient']
-
-    mapped_sales['cost_of_demand'] = 0
+    for mapped_resource in (mapped_stock, mapped_production, mapped_movement, mapped_procurement):
+        mapped_resource['cost_of_allocated'] = -mapped_resource['cost'] * \
+                                               mapped_resource['order_operation_volume'] * \
+                                               mapped_resource['coefficient']
 
     # calculate total cost for each order in the operation
-    cost_stocks = mapped_stock.groupby('label')['cost_of_allocated'].sum()
-    cost_movement = mapped_movement.groupby('label')['cost_of_allocated'].sum()
-    cost_procurement = mapped_procurement.groupby('label')['cost_of_allocated'].sum()
-    cost_production = mapped_production.groupby('label')['cost_of_allocated'].sum()
-
-    cost_list = [cost_stocks, cost_movement, cost_procurement, cost_production]
-
-    # calculate the cost of demand for this order if the order is in the mapped table
-    for order in pd.unique(mapped_sales['keys']):
-        cost_of_demand = sum(cost.loc[order] for cost in cost_list if order in cost.index)
-        mapped_sales.loc[mapped_sales['keys'] == order, 'cost_of_demand'] = cost_of_demand
-
-    return mapped_sales, mapped_stock, mapped_movement, mapped_procurement, mapped_production
-
-
-def run_resource_mapper():
-    pd.set_option('display.float_format', lambda x: '%.3f' % x)
-
-    # load data
-    df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity, df_demand = data_loader(
-        config.configid,
-        config.datasetid,
-        config.runid,
-        config.period,
-        config.time_direction,
-        config.priority,
-        config.lead_time
+    cost_of_allocated = pd.concat(
+        [mapped_resource[['label', 'cost_of_allocated']]
+         for mapped_resource in (mapped_stock, mapped_movement, mapped_procurement, mapped_production)],
+        ignore_index=True
     )
+    cost_of_orders = cost_of_allocated.groupby('label', observed=True)['cost_of_allocated'].sum()
 
-    # Create empty DataFrames to store the mapped resources
-    mapped_stock = pd.DataFrame()
-    mapped_production = pd.DataFrame()
-    mapped_movement = pd.DataFrame()
-    mapped_procurement = pd.DataFrame()
-    mapped_capacity = pd.DataFrame()
-    mapped_sales = pd.DataFrame()
+    # map the cost of demand onto the orders, orders without mapped resources cost nothing
+    mapped_sales['cost_of_demand'] = mapped_sales['keys'].astype(object).map(cost_of_orders).fillna(0)
 
-    # Iterate over rows in sorted sales dataframe
-    for sale in tqdm(df_sales.iterrows(), total=len(df_sales)):
-        # get the order_id and the row of the sale
-        order_id, order = sale
+    return mapped_sales, mapped_stock, mapped_production, mapped_movement, mapped_procurement
 
-        # name series with its index
-        order.name = order_id
 
-        # label
-        label = order['keys']
+def summarize_mapping(inputs, mapped_records, resource_state, runid=None, entities=None):
+    """
+    Writes the leftovers into the resources, creates the mapped DataFrames with their costs and the summary table
+    :param inputs: tuple of pd.DataFrames returned by data_loader
+    :param mapped_records: dict, mapped rows of all orders
+    :param resource_state: dict, leftovers of the resources after mapping
+    :param runid: int, run of the summary table, config.runid if not given
+    :param entities: dict, dictionary of the entities encoded in the mapped rows, the names are decoded with it
+    :return: pd.DataFrame, summary table
+    """
+    df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity, df_demand = inputs
 
-        # run recursive mapping and get updated resources
-        result = map_resources(order, order_id, label, df_stock, df_production, df_movement, df_procurement,
-                               config.map_priority, df_bom, df_capacity, config.threshold)
+    # update resources dataframes with the leftovers
+    update_resource_frames(resource_state, df_stock, df_production, df_movement, df_procurement, df_capacity)
 
-        # unpack the results
-        df_stock_updated, df_production_updated, df_movement_updated, df_procurement_updated, df_capacity_updated, \
-            stock, production, movement, procurement, capacity = result
+    # create the mapped DataFrames
+    mapped_sales, mapped_stock, mapped_production, mapped_movement, mapped_procurement, mapped_capacity = \
+        materialize_mapped_records(mapped_records)
 
-        # update resources dataframes
-        df_stock, df_production, df_movement, df_procurement = \
-            df_stock_updated, df_production_updated, df_movement_updated, df_procurement_updated
-
-        # update mapped resources
-        mapped_stock = pd.concat([mapped_stock, stock], ignore_index=True)
-        mapped_production = pd.concat([mapped_production, production], ignore_index=True)
-        mapped_movement = pd.concat([mapped_movement, movement], ignore_index=True)
-        mapped_procurement = pd.concat([mapped_procurement, procurement], ignore_index=True)
-        mapped_capacity = pd.concat([mapped_capacity, capacity], ignore_index=True)
-
-        print(f'\nOrder: {order_id} ({label}) has been mapped.')
-
-        # update mapped sales
-        order = order.to_frame().T
-        order['order_id'] = order_id
-        mapped_sales = pd.concat([mapped_sales, order])
+    # decode the names of the entities
+    if entities is not None:
+        mapped_sales, mapped_stock, mapped_production, mapped_movement, mapped_procurement, mapped_capacity = [
+            decode_entities(df, entities)
+            for df in (mapped_sales, mapped_stock, mapped_production, mapped_movement, mapped_procurement,
+                       mapped_capacity)
+        ]
 
     # pack the resources
     mapped_resources = mapped_sales, mapped_stock, mapped_production, mapped_movement, mapped_procurement
@@ -199,11 +161,121 @@ def run_resource_mapper():
     mapped_resources = mapped_sales, mapped_stock, mapped_production, mapped_movement, mapped_procurement, mapped_capacity
 
     # calculate the summary table
-    summary_table = process_mapped_resources(mapped_resources, df_demand)
+    return process_mapped_resources(mapped_resources, df_demand, runid)
+
+
+def run_resource_mapper(resume=False):
+    """
+    Loads, maps and exports the run of the config
+    :param resume: bool, whether to continue the mapping from the checkpoint of an interrupted run
+    """
+    pd.set_option('display.float_format', lambda x: '%.3f' % x)
+
+    # only the serial mapping saves checkpoints
+    if resume and config.checkpoint_dir is None:
+        raise ValueError('--resume needs config.checkpoint_dir, the directory of the checkpoints of the runs')
+    if resume and config.workers > 1:
+        raise ValueError('--resume needs config.workers = 1, the parallel mapping does not save checkpoints')
+
+    # load the mapping of the previous run, before the inputs so that --resume fails early
+    previous_mapping = None
+    if config.mapping_dir is not None and config.previous_runid is not None:
+        previous_key = cache_key(config.configid, config.datasetid, config.previous_runid, config.period,
+                                 config.time_direction, config.priority, config.lead_time, config.threshold,
+                                 config.numeric_mode, config.categoricals)
+        previous_mapping = load_mapping(config.mapping_dir, previous_key)
+        if resume and previous_mapping is not None:
+            raise ValueError(f'--resume cannot continue the incremental mapping of the run {config.runid} from the '
+                             f'run {config.previous_runid}, it does not save checkpoints')
+
+    # load data from the cache or from the database
+    key = cache_key(config.configid, config.datasetid, config.runid, config.period, config.time_direction,
+                    config.priority, config.lead_time, config.threshold, config.numeric_mode, config.categoricals)
+    inputs = None
+    if config.cache_dir is not None:
+        if config.refresh_cache:
+            invalidate_cache(config.cache_dir, key)
+        inputs = read_cache(config.cache_dir, key)
+        if inputs is not None:
+            print(f'Inputs have been read from the cache {config.cache_dir}, set refresh_cache to reload them.')
+    if inputs is None:
+        inputs = data_loader(
+            config.configid,
+            config.datasetid,
+            config.runid,
+            config.period,
+            config.time_direction,
+            config.priority,
+            config.lead_time,
+            config.numeric_mode,
+            config.load_method,
+            config.db_connections,
+            config.categoricals
+        )
+        if config.cache_dir is not None:
+            write_cache(config.cache_dir, key, inputs, config.cache_size)
+    df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity, df_demand = inputs
+
+    # threshold in the type of the loaded quantities
+    threshold = get_threshold(config.threshold, config.numeric_mode)
+
+    # the mapper works on integer codes of the entities, the codes of the previous run are kept
+    entities = build_entity_dictionary(inputs, previous_mapping.get('entities') if previous_mapping else None)
+    inputs = encode_inputs(inputs, entities)
+    df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity, df_demand = inputs
+
+    # checkpoint of the serial mapping of the run
+    checkpoint_path = None
+    if config.checkpoint_dir is not None:
+        checkpoint_path = os.path.join(config.checkpoint_dir, f'{key}.checkpoint')
+
+    # map the sales in the order of df_sales
+    # the traces are only used by the incremental runs, which reuse the saved mappings
+    traces = {} if config.mapping_dir is not None else None
+    stats = {} if config.stats_file is not None else None
+    if previous_mapping is not None:
+        mapped_records, resource_state = remap_sales(
+            previous_mapping, df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity,
+            config.map_priority, threshold, config.engine, traces=traces, stats=stats
+        )
+    elif config.workers > 1:
+        mapped_records, resource_state = map_sales_parallel(
+            df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity,
+            config.map_priority, threshold, config.engine, config.workers, traces, stats
+        )
+    else:
+        mapped_records, resource_state = map_sales(
+            df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity,
+            config.map_priority, threshold, config.engine, traces=traces, stats=stats,
+            checkpoint_path=checkpoint_path, checkpoint_orders=config.checkpoint_orders,
+            checkpoint_seconds=config.checkpoint_seconds, resume=resume
+        )
+
+    # export the counters of the mapped orders
+    if stats is not None:
+        export_stats(stats, config.stats_file)
+
+    # save the mapping for the incremental runs, before the leftovers are written into the inputs
+    if config.mapping_dir is not None:
+        save_mapping(config.mapping_dir, key,
+                     build_mapping_snapshot(inputs, mapped_records, traces, threshold, config.map_priority,
+                                            entities))
+
+    # calculate the summary table
+    summary_table = summarize_mapping(inputs, mapped_records, resource_state, entities=entities)
 
     # export the summary table
     utils.export_summary_table(summary_table)
 
+    # the run is completed, a later run maps it from the start
+    if checkpoint_path is not None:
+        remove_checkpoint(checkpoint_path)
+
 
 if __name__ == '__main__':
-    run_resource_mapper()
+    parser = argparse.ArgumentParser(description='Maps the resources to the sales of the run of the config')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the mapping from the checkpoint of an interrupted run in config.checkpoint_dir')
+    args = parser.parse_args()
+
+    run_resource_mapper(args.resume)
@@ -0,0 +1,123 @@
+import pandas as pd
+
+
+# columns added to the resource columns in the mapped tables
+MAPPED_COLUMNS = {
+    'stock': ['order_id', 'label', 'residual', 'spend', 'order_operation_volume'],
+    'production': ['order_id', 'prod_id', 'label', 'residual', 'order_operation_volume'],
+    'movement': ['order_id', 'label', 'residual', 'order_operation_volume'],
+    'procurement': ['order_id', 'label', 'residual', 'order_operation_volume'],
+    'capacity': ['order_id', 'prod_id', 'label', 'resource_consumption_operation'],
+}
+
+
+def get_categorical_dtypes(df):
+    """ Returns the categorical dtypes of the columns of the DataFrame, the mapped tables keep them """
+    return {column: dtype for column, dtype in df.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)}
+
+
+def build_mapped_records(df_sales, df_stock, df_production, df_movement, df_procurement, df_capacity):
+    """
+    Creates the accumulator of the mapped rows shared by all orders.
+    Rows are appended as lists and turned into DataFrames once, after all orders are mapped
+    :param df_sales: pd.DataFrame, sales to be mapped
+    :param df_stock: pd.Dataframe, data related to storage
+    :param df_production: pd.DataFrame, data related to production
+    :param df_movement: pd.Dataframe, data related to transportation
+    :param df_procurement: pd.Dataframe, data related to procurement
+    :param df_capacity: pd.Dataframe, data related to production capacities
+    :return: dict, columns and rows of each mapped table, and the latest mapped row of each keys of the resource tables
+    """
+    frames = {
+        'stock': df_stock,
+        'production': df_production,
+        'movement': df_movement,
+        'procurement': df_procurement,
+        'capacity': df_capacity,
+    }
+    # the labels of the mapped rows are the keys of the sales
+    label_dtypes = {}
+    if isinstance(df_sales['keys'].dtype, pd.CategoricalDtype):
+        label_dtypes['label'] = df_sales['keys'].dtype
+
+    mapped_records = {}
+    for table, df in frames.items():
+        columns = list(df.columns) + [column for column in MAPPED_COLUMNS[table] if column not in df.columns]
+        mapped_records[table] = {'columns': pd.Index(columns), 'rows': [], 'last': {},
+                                 'dtypes': {**get_categorical_dtypes(df), **label_dtypes}}
+
+    # mapped sales are indexed by order_id
+    mapped_records['sales'] = {'columns': pd.Index(list(df_sales.columns) + ['order_id']), 'rows': [], 'index': [],
+                               'dtypes': get_categorical_dtypes(df_sales)}
+
+    return mapped_records
+
+
+def append_mapped_row(mapped_records, table, row):
+    """ Appends the mapped pd.Series to the table, missing columns are filled with NaN """
+    records = mapped_records[table]
+    records['rows'].append(row.reindex(records['columns']).tolist())
+    index_last_rows(records, records['rows'][-1:])
+
+
+def append_mapped_rows(mapped_records, table, df):
+    """ Appends the rows of the mapped pd.DataFrame to the table, missing columns are filled with NaN """
+    records = mapped_records[table]
+    rows = df.reindex(columns=records['columns']).to_numpy(dtype=object).tolist()
+    records['rows'].extend(rows)
+    index_last_rows(records, rows)
+
+
+def index_last_rows(records, rows):
+    """ Records the rows as the latest mapped rows of their keys, the rows are given in the order they are mapped """
+    if 'keys' not in records['columns']:
+        return
+    keys_position = records['columns'].get_loc('keys')
+    last = records['last']
+    for row in rows:
+        last[row[keys_position]] = row
+
+
+def append_mapped_sale(mapped_records, order, order_id):
+    """ Appends the mapped sale with its order_id """
+    records = mapped_records['sales']
+    row = order.reindex(records['columns'])
+    row['order_id'] = order_id
+    records['rows'].append(row.tolist())
+    records['index'].append(order_id)
+
+
+def count_mapped_rows(mapped_records, table):
+    """ Returns the number of rows mapped to the table """
+    return len(mapped_records[table]['rows'])
+
+
+def update_last_residual(mapped_records, table, keys, residual):
+    """ Updates the residual of the latest mapped row of the table with the desired keys """
+    records = mapped_records[table]
+    row = records['last'].get(keys)
+    if row is not None:
+        row[records['columns'].get_loc('residual')] = residual
+
+
+def materialize_mapped_records(mapped_records):
+    """
+    Creates the mapped DataFrames from the accumulated rows
+    :param mapped_records: dict, columns and rows of each mapped table
+    :return: tuple of pd.DataFrames: mapped resources
+             (mapped_sales, mapped_stock, mapped_production, mapped_movement, mapped_procurement, mapped_capacity)
+    """
+    def to_frame(table, index=None):
+        records = mapped_records[table]
+        df = pd.DataFrame(records['rows'], columns=records['columns'], index=index, dtype=object)
+        # native dtypes for the columns which allow them, the entity columns keep their categories
+        return df.infer_objects().astype(records['dtypes'])
+
+    mapped_sales = to_frame('sales', index=mapped_records['sales']['index']).astype({'order_id': 'int64'})
+    mapped_stock = to_frame('stock')
+    mapped_production = to_frame('production')
+    mapped_movement = to_frame('movement')
+    mapped_procurement = to_frame('procurement')
+    mapped_capacity = to_frame('capacity')
+
+    return mapped_sales, mapped_stock, mapped_production, mapped_movement, mapped_procurement, mapped_capacity
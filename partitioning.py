@@ -0,0 +1,180 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from mapped_records import build_mapped_records, index_last_rows
+from resource_mapper import map_sales
+from resource_state import build_resource_state, LEFTOVER_COLUMNS
+
+
+def find_root(parents, node):
+    """ Finds the representative of the node's component and compresses the path to it """
+    root = parents.setdefault(node, node)
+    while root != parents[root]:
+        root = parents[root]
+    while node != root:
+        parents[node], node = root, parents[node]
+    return root
+
+
+def union(parents, node, other):
+    """ Joins the components of two nodes """
+    root, other_root = find_root(parents, node), find_root(parents, other)
+    if root != other_root:
+        parents[other_root] = root
+
+
+def find_components(df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity):
+    """
+    Splits the supply network into connected components.
+    The nodes are (product, location) pairs, which are joined by transport lanes and by the inputs of the BOMs,
+    so that sales of different components never compete for the same resource rows
+    :return: dict, component label of every row of each table
+    """
+    parents = {}
+
+    # transport lanes join the product at both locations
+    for product, loc_from, loc_to in zip(df_movement['product'], df_movement['loc_from'], df_movement['loc_to']):
+        union(parents, (product, loc_to), (product, loc_from))
+
+    # BOM inputs and outputs are joined at the BOM location
+    bom_nodes = {}
+    for bomnum, product, location in zip(df_bom['bomnum'], df_bom['product'], df_bom['location']):
+        node = (product, location)
+        union(parents, bom_nodes.setdefault(bomnum, node), node)
+
+    # productions are joined to their BOMs
+    for bomnum, product, location in zip(df_production['bomnum'], df_production['product'],
+                                         df_production['location']):
+        node = (product, location)
+        union(parents, bom_nodes.setdefault(bomnum, node), node)
+    for bomnum, product, location in zip(df_capacity['bomnum'], df_capacity['product'], df_capacity['location']):
+        node = (product, location)
+        union(parents, bom_nodes.setdefault(bomnum, node), node)
+
+    def label_rows(products, locations):
+        return [find_root(parents, (product, location)) for product, location in zip(products, locations)]
+
+    return {
+        'sales': label_rows(df_sales['product'], df_sales['loc_from']),
+        'stock': label_rows(df_stock['product'], df_stock['loc_to']),
+        'production': label_rows(df_production['product'], df_production['loc_to']),
+        'movement': label_rows(df_movement['product'], df_movement['loc_to']),
+        'procurement': label_rows(df_procurement['product'], df_procurement['loc_to']),
+        'bom': label_rows(df_bom['product'], df_bom['location']),
+        'capacity': label_rows(df_capacity['product'], df_capacity['location']),
+    }
+
+
+def partition_sales(df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity,
+                    partitions):
+    """
+    Groups the connected components of the supply network with sales into partitions of similar number of sales
+    :param partitions: int, maximum number of partitions
+    :return: list of dicts, row positions of every table in each partition
+    """
+    components = find_components(df_sales, df_stock, df_production, df_movement, df_procurement, df_bom,
+                                 df_capacity)
+
+    # count the sales of each component
+    sales_count = {}
+    for component in components['sales']:
+        sales_count[component] = sales_count.get(component, 0) + 1
+
+    # assign the largest components first to the partition with the fewest sales
+    partition_sales_count = [0] * min(partitions, len(sales_count))
+    partition_of = {}
+    for component in sorted(sales_count, key=sales_count.get, reverse=True):
+        partition = int(np.argmin(partition_sales_count))
+        partition_of[component] = partition
+        partition_sales_count[partition] += sales_count[component]
+
+    # collect the row positions of each partition, keeping the order of the rows
+    result = [{table: [] for table in components} for _ in partition_sales_count]
+    for table, labels in components.items():
+        for position, component in enumerate(labels):
+            if component in partition_of:
+                result[partition_of[component]][table].append(position)
+
+    return result
+
+
+def map_partition(args):
+    """ Maps the sales of one partition, run in a worker process """
+    df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity, map_priority, threshold, \
+        engine, collect_traces, collect_stats = args
+    traces = {} if collect_traces else None
+    stats = {} if collect_stats else None
+    mapped_records, resource_state = map_sales(df_sales, df_stock, df_production, df_movement, df_procurement,
+                                               df_bom, df_capacity, map_priority, threshold, engine, verbose=False,
+                                               traces=traces, stats=stats)
+    return mapped_records, resource_state, traces, stats
+
+
+def map_sales_parallel(df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity,
+                       map_priority, threshold, engine='recursive', workers=1, traces=None, stats=None):
+    """
+    Maps the sales of independent components of the supply network in a pool of worker processes.
+    The mapped rows are merged in the order of df_sales, so the result is the same as of map_sales
+    :param workers: int, number of worker processes
+    :param traces: dict, collects the lookups and the resource updates of each order_id
+    :param stats: dict, collects the counters of each order_id
+    :return: tuple of dicts: mapped rows and leftovers of the resources (mapped_records, resource_state)
+    """
+    frames = {
+        'sales': df_sales,
+        'stock': df_stock,
+        'production': df_production,
+        'movement': df_movement,
+        'procurement': df_procurement,
+        'bom': df_bom,
+        'capacity': df_capacity,
+    }
+    partitions = partition_sales(df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity,
+                                 workers * 4)
+
+    # slice the tables of each partition, the row labels are kept
+    tasks = []
+    for partition in partitions:
+        tables = [frames[table].iloc[partition[table]] for table in frames]
+        tasks.append((*tables, map_priority, threshold, engine, traces is not None, stats is not None))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(map_partition, tasks))
+
+    # merge the leftovers of the partitions
+    resource_state = build_resource_state(df_stock, df_production, df_movement, df_procurement, df_capacity)
+    for partition, (_, partition_state, _, _) in zip(partitions, results):
+        for table, columns in LEFTOVER_COLUMNS.items():
+            for column in columns:
+                resource_state[table][column][partition[table]] = partition_state[table][column]
+
+    # merge the mapped rows in the order of the sales,
+    # the sort is stable, so the rows of every order keep their mapping order
+    sale_order = {order_id: i for i, order_id in enumerate(df_sales.index)}
+    mapped_records = build_mapped_records(df_sales, df_stock, df_production, df_movement, df_procurement, df_capacity)
+    for table, records in mapped_records.items():
+        order_id_position = records['columns'].get_loc('order_id')
+        for partition_records, _, _, _ in results:
+            records['rows'].extend(partition_records[table]['rows'])
+        records['rows'].sort(key=lambda row: sale_order[row[order_id_position]])
+        if table != 'sales':
+            index_last_rows(records, records['rows'])
+    sales_records = mapped_records['sales']
+    order_id_position = sales_records['columns'].get_loc('order_id')
+    sales_records['index'] = [row[order_id_position] for row in sales_records['rows']]
+
+    # merge the traces of the orders, the resource rows are traced by their labels
+    if traces is not None:
+        for _, _, partition_traces, _ in results:
+            traces.update(partition_traces)
+
+    # merge the counters of the orders in the order of the sales
+    if stats is not None:
+        partition_stats = {}
+        for _, _, _, order_stats in results:
+            partition_stats.update(order_stats)
+        stats.update((order_id, partition_stats[order_id]) for order_id in df_sales.index
+                     if order_id in partition_stats)
+
+    return mapped_records, resource_state
@@ -1,13 +1,21 @@
-import pandas as pd
-import numpy as np
 from decimal import Decimal
+import time
+from tqdm import tqdm
+from candidate_index import build_candidate_index, lookup_candidates, update_candidate, refresh_candidates
+from checkpoint import build_checkpoint_log, save_checkpoint, load_checkpoint, remove_checkpoint
+from resource_state import build_resource_state, update_resource_frames
+from bom_index import build_bom_index, lookup_bom
+from instrumentation import build_order_stats, timed, counted_candidates, tracked_depth
+from mapped_records import (build_mapped_records, append_mapped_row, append_mapped_rows, append_mapped_sale,
+                            count_mapped_rows, update_last_residual, materialize_mapped_records)
 
 
 # TODO: take into account periods, procurement, costs, leftovers, parametrize, output the order with residual
 def map_resources(order, order_id, label,
                   df_stock, df_production, df_movement, df_procurement, map_priority,
                   df_bom, df_capacity,
-                  threshold=Decimal('0.1')):
+                  threshold=Decimal('0.1'), candidate_index=None, resource_state=None, mapped_records=None,
+                  engine='recursive', trace=None, stats=None, bom_index=None):
     """
     Recursively maps the resources in df_production, df_stock and df_movement with index of sale in order
     :param order: pd.Series, sale specification
@@ -20,57 +28,66 @@ def map_resources(order, order_id, label,
     :param map_priority: dict, priority of resources
     :param df_bom: pd.Dataframe with BOMs data
     :param df_capacity: pd.Dataframe, data related to production capacities
-    :param threshold: Decimal, threshold for comparing real numbers
+    :param threshold: Decimal or float, threshold for comparing real numbers in the type of the quantities
+    :param candidate_index: dict, index of the resource rows built once per run, built for this order if not given
+    :param resource_state: dict, leftovers of the resources shared between orders, the leftovers are written back
+                           into the resource DataFrames after mapping the order if not given
+    :param mapped_records: dict, accumulator of the mapped rows shared between orders
+    :param engine: str, 'recursive' maps the resources with Python recursion, 'iterative' walks the same allocations
+                   with an explicit stack and is not limited by the recursion depth
+    :param trace: dict, collects the (product, location) pairs whose resources are looked up for the order,
+                  the leftovers of the allocated resource rows after every update and the labels of the mapped
+                  capacity rows
+    :param stats: dict, counters of the order, the steps of the mapping are only wrapped with the counters if given
+    :param bom_index: dict, index of the BOM inputs and capacities built once per run, built for this order if not given
     :return: tuple of pd.Dataframes: updated and mapped resources
-            (df_production, df_stock, df_movement, df_procurement,
-             mapped_production, mapped_stock, mapped_movement, mapped_procurement)
+            (df_stock, df_production, df_movement, df_procurement, df_capacity,
+             mapped_stock, mapped_production, mapped_movement, mapped_procurement, mapped_capacity),
+            the mapped resources are None if the mapped rows are appended to the shared mapped_records
     """
-    # create empty dataframes for mapping and add columns
-    t = pd.DataFrame({'order_id': [], 'label': [], 'residual': [], 'spend': [], 'order_operation_volume': []})
-    mapped_stock = pd.concat([pd.DataFrame(columns=df_stock.columns), t])
-
-    t = pd.DataFrame({'order_id': [], 'prod_id': [], 'label': [], 'residual': [], 'order_operation_volume': []})
-    mapped_production = pd.concat([pd.DataFrame(columns=df_production.columns), t])
-
-    t = pd.DataFrame({'order_id': [], 'label': [], 'residual': [], 'order_operation_volume': []})
-    mapped_movement = pd.concat([pd.DataFrame(columns=df_movement.columns), t])
-    mapped_procurement = pd.concat([pd.DataFrame(columns=df_procurement.columns), t])
-
-    t = pd.DataFrame({'order_id': [], 'prod_id': [], 'label': [], 'resource_consumption_operation': []})
-    mapped_capacity = pd.concat([pd.DataFrame(columns=df_capacity.columns), t])
-
-    # pack the resources
-    resources = df_stock, df_production, df_movement, df_procurement
-    mapped_resources = mapped_stock, mapped_production, mapped_movement, mapped_procurement
-
-    def update_mapped_residual(order, mapped_resources):
-
-        # unpack the mapped resources
-        mapped_stock, mapped_production, mapped_movement, mapped_procurement = mapped_resources
+    # build the candidate index if it is not shared between orders
+    if candidate_index is None:
+        candidate_index = build_candidate_index(df_stock, df_production, df_movement, df_procurement, threshold)
+
+    # build the BOM index if it is not shared between orders
+    if bom_index is None:
+        bom_index = build_bom_index(df_bom, df_capacity)
+
+    # keep the leftovers in the resource state if it is not shared between orders
+    update_frames = resource_state is None
+    if update_frames:
+        resource_state = build_resource_state(df_stock, df_production, df_movement, df_procurement, df_capacity)
+
+    # accumulate the mapped rows of this order if they are not shared between orders
+    materialize = mapped_records is None
+    if materialize:
+        mapped_records = build_mapped_records(order.to_frame().T, df_stock, df_production, df_movement,
+                                              df_procurement, df_capacity)
+
+    # resource tables by the operation type of their candidates
+    frames = {
+        'stock': df_stock,
+        'production': df_production,
+        'movement': df_movement,
+        'procurement': df_procurement,
+    }
+
+    # production ids are counted within the order
+    production_start = count_mapped_rows(mapped_records, 'production')
+
+    def update_mapped_residual(order):
 
         # find the latest row with the desired 'keys' and update its residual
-        if order['operation_type'] == 'stock':
-            last_index = mapped_stock.loc[mapped_stock['keys'] == order['keys']].index[-1]
-            mapped_stock.loc[last_index, 'residual'] = order['residual']
-
-        elif order['operation_type'] == 'production':
-            last_index = mapped_production.loc[mapped_production['keys'] == order['keys']].index[-1]
-            mapped_production.loc[last_index, 'residual'] = order['residual']
-
-        elif order['operation_type'] == 'movement':
-            last_index = mapped_movement.loc[mapped_movement['keys'] == order['keys']].index[-1]
-            mapped_movement.loc[last_index, 'residual'] = order['residual']
+        if order['operation_type'] in ('stock', 'production', 'movement', 'procurement'):
+            update_last_residual(mapped_records, order['operation_type'], order['keys'], order['residual'])
 
-        elif order['operation_type'] == 'procurement':
-            last_index = mapped_procurement.loc[mapped_procurement['keys'] == order['keys']].index[-1]
-            mapped_procurement.loc[last_index, 'residual'] = order['residual']
+    def trace_update(table, name, position):
+        # record the leftovers of the updated resource row
+        if trace is not None:
+            leftovers = tuple(leftovers[position] for leftovers in resource_state[table].values())
+            trace['updates'].append((table, name, leftovers))
 
-        # pack the mapped resources
-        mapped_resources = mapped_stock, mapped_production, mapped_movement, mapped_procurement
-
-        return mapped_resources
-
-    def map_stock(order, product_stock, resources, mapped_resources):
+    def map_stock(order, product_stock):
 
         # map the product in stock
         product_stock['order_id'] = order_id
@@ -96,11 +113,7 @@ def map_resources(order, order_id, label,
                 product_stock['ps_leftover'] = 0
 
         # update the residual
-        mapped_resources = update_mapped_residual(order, mapped_resources)
-
-        # unpack the resources
-        df_stock, df_production, df_movement, df_procurement = resources
-        mapped_stock, mapped_production, mapped_movement, mapped_procurement = mapped_resources
+        update_mapped_residual(order)
 
         if order['operation_type'] == product_stock['operation_type']:
             spend = product_stock['order_operation_volume']
@@ -125,22 +138,25 @@ def map_resources(order, order_id, label,
             else:
                 product_stock['is_leftover'] = 0
 
-        # append to a mapped dataframe
-        mapped_stock.loc[len(mapped_stock.index)] = product_stock
+        # append to the mapped rows
+        append_mapped_row(mapped_records, 'stock', product_stock)
 
         # update resource leftover for storage
-        df_stock.loc[product_stock.name, 'ps_leftover'] = product_stock['ps_leftover']
-        df_stock.loc[product_stock.name, 'sv_leftover'] = product_stock['sv_leftover']
-        df_stock.loc[product_stock.name, 'is_leftover'] = product_stock['is_leftover']
-        df_stock.loc[product_stock.name, 'er_leftover'] = product_stock['er_leftover']
+        position = df_stock.index.get_loc(product_stock.name)
+        stock_state = resource_state['stock']
+        stock_state['ps_leftover'][position] = product_stock['ps_leftover']
+        stock_state['sv_leftover'][position] = product_stock['sv_leftover']
+        stock_state['is_leftover'][position] = product_stock['is_leftover']
+        stock_state['er_leftover'][position] = product_stock['er_leftover']
+        trace_update('stock', product_stock.name, position)
 
-        # pack the resources
-        resources = df_stock, df_production, df_movement, df_procurement
-        mapped_resources = mapped_stock, mapped_production, mapped_movement, mapped_procurement
+        # update the candidate index
+        update_candidate(candidate_index, 'stock_sv', position, product_stock['sv_leftover'], threshold)
+        update_candidate(candidate_index, 'stock_ps', position, product_stock['ps_leftover'], threshold)
 
-        return product_stock, resources, mapped_resources
+        return product_stock
 
-    def map_production(order, product_production, resources, mapped_resources):
+    def map_production(order, product_production):
 
         # map the product in production
         product_production['order_id'] = order_id
@@ -159,25 +175,22 @@ def map_resources(order, order_id, label,
             product_production['leftover'] = 0
 
         # update the residual
-        mapped_resources = update_mapped_residual(order, mapped_resources)
-
-        # unpack the resources
-        df_stock, df_production, df_movement, df_procurement = resources
-        mapped_stock, mapped_production, mapped_movement, mapped_procurement = mapped_resources
+        update_mapped_residual(order)
 
-        # append to a mapped dataframe
-        mapped_production.loc[len(mapped_production.index)] = product_production
+        # append to the mapped rows
+        append_mapped_row(mapped_records, 'production', product_production)
 
         # update production leftover
-        df_production.loc[product_production.name, 'leftover'] = product_production['leftover']
+        position = df_production.index.get_loc(product_production.name)
+        resource_state['production']['leftover'][position] = product_production['leftover']
+        trace_update('production', product_production.name, position)
 
-        # pack the resources
-        resources = df_stock, df_production, df_movement, df_procurement
-        mapped_resources = mapped_stock, mapped_production, mapped_movement, mapped_procurement
+        # update the candidate index
+        update_candidate(candidate_index, 'production', position, product_production['leftover'], threshold)
 
-        return product_production, resources, mapped_resources
+        return product_production
 
-    def map_movement(order, product_movement, resources, mapped_resources):
+    def map_movement(order, product_movement):
 
         # map the product in movement
         product_movement['order_id'] = order_id
@@ -196,28 +209,25 @@ def map_resources(order, order_id, label,
             product_movement['leftover'] = 0
 
         # update the residual
-        mapped_resources = update_mapped_residual(order, mapped_resources)
-
-        # unpack the resources
-        df_stock, df_production, df_movement, df_procurement = resources
-        mapped_stock, mapped_production, mapped_movement, mapped_procurement = mapped_resources
+        update_mapped_residual(order)
 
         # update resource residual
         product_movement['residual'] = product_movement['order_operation_volume']
 
-        # append to a mapped dataframe
-        mapped_movement.loc[len(mapped_movement.index)] = product_movement
+        # append to the mapped rows
+        append_mapped_row(mapped_records, 'movement', product_movement)
 
         # update resource leftover
-        df_movement.loc[product_movement.name, 'leftover'] = product_movement['leftover']
+        position = df_movement.index.get_loc(product_movement.name)
+        resource_state['movement']['leftover'][position] = product_movement['leftover']
+        trace_update('movement', product_movement.name, position)
 
-        # pack the resources
-        resources = df_stock, df_production, df_movement, df_procurement
-        mapped_resources = mapped_stock, mapped_production, mapped_movement, mapped_procurement
+        # update the candidate index
+        update_candidate(candidate_index, 'movement', position, product_movement['leftover'], threshold)
 
-        return product_movement, resources, mapped_resources
+        return product_movement
 
-    def map_procurement(order, product_procurement, resources, mapped_resources):
+    def map_procurement(order, product_procurement):
 
         # map the product in production
         product_procurement['order_id'] = order_id
@@ -236,348 +246,406 @@ def map_resources(order, order_id, label,
             product_procurement['leftover'] = 0
 
         # update the residual
-        mapped_resources = update_mapped_residual(order, mapped_resources)
-
-        # unpack the resources
-        df_stock, df_production, df_movement, df_procurement = resources
-        mapped_stock, mapped_production, mapped_movement, mapped_procurement = mapped_resources
+        update_mapped_residual(order)
 
         # update resource residual
         product_procurement['residual'] = product_procurement['order_operation_volume']
 
-        # append to a mapped dataframe
-        mapped_procurement.loc[len(mapped_procurement.index)] = product_procurement
+        # append to the mapped rows
+        append_mapped_row(mapped_records, 'procurement', product_procurement)
 
         # update resource leftover
-        df_procurement.loc[product_procurement.name, 'leftover'] = product_procurement['leftover']
+        position = df_procurement.index.get_loc(product_procurement.name)
+        resource_state['procurement']['leftover'][position] = product_procurement['leftover']
+        trace_update('procurement', product_procurement.name, position)
 
-        # pack the resources
-        resources = df_stock, df_production, df_movement, df_procurement
-        mapped_resources = mapped_stock, mapped_production, mapped_movement, mapped_procurement
+        # update the candidate index
+        update_candidate(candidate_index, 'procurement', position, product_procurement['leftover'], threshold)
 
-        return product_procurement, resources, mapped_resources
+        return product_procurement
 
     def get_bom_orders(product_production, df_bom):
-        # get the BOM
-        df_product_bom = df_bom[
-            (df_bom['bomnum'] == product_production['bomnum']) &
-            (df_bom['period'] == product_production['period']) &
-            (df_bom['input_output'] < 0)
-            ].copy()
+        # get the BOM inputs
+        positions = lookup_bom(bom_index, 'bom', product_production['bomnum'], product_production['period'])
+        df_product_bom = df_bom.iloc[positions].copy()
         # form orders for supplies
         df_product_bom['order_id'] = product_production['order_id']
         df_product_bom['label'] = product_production['label']
         df_product_bom['loc_from'], df_product_bom['loc_to'] = df_product_bom['location'], df_product_bom['location']
         df_product_bom['prod_quantity'] = -df_product_bom['input_output'] * product_production['order_operation_volume']
         df_product_bom['residual'] = df_product_bom['prod_quantity']
-        df_product_bom['leftover'] = Decimal('0')
+        df_product_bom['leftover'] = df_product_bom['prod_quantity'] * 0
         df_product_bom['order_operation_volume'] = df_product_bom['prod_quantity']
         df_product_bom['operation_type'] = 'bom'
 
         return df_product_bom
 
     def get_capacity(product_production, df_capacity):
-        # get the capacity
-        df_product_capacity = df_capacity[
-            (df_capacity['bomnum'] == product_production['bomnum']) &
-            (df_capacity['period'] == product_production['period'])
-            ].copy()
-        return df_product_capacity
-
-    def map_capacity(order_id, label, df_product_capacity, product_production, mapped_capacity, df_capacity):
+        # get the positions of the capacity rows of the production
+        return lookup_bom(bom_index, 'capacity', product_production['bomnum'], product_production['period'])
+
+    def map_capacity(order_id, label, positions, product_production, df_capacity):
+        # consume the capacities of the production in the resource state
+        consumption = product_production['order_operation_volume'] * bom_index['var_production_cons'][positions]
+        leftovers = resource_state['capacity']['leftover']
+        leftovers[positions] -= consumption
+
         # map the capacity
+        df_product_capacity = df_capacity.iloc[positions].copy()
         df_product_capacity['order_id'] = order_id
         df_product_capacity['label'] = label
         df_product_capacity['prod_id'] = product_production['prod_id']
-        df_product_capacity['resource_consumption_operation'] = product_production['order_operation_volume'] * \
-                                                                df_product_capacity['var_production_cons']
-        df_product_capacity['leftover'] -= df_product_capacity['resource_consumption_operation']
+        df_product_capacity['resource_consumption_operation'] = consumption
+        df_product_capacity['leftover'] = leftovers[positions]
+        append_mapped_rows(mapped_records, 'capacity', df_product_capacity)
+
+        if trace is not None:
+            trace['capacity'].extend(df_product_capacity.index)
+
+    def get_candidates(df, table, positions):
+        # copy the candidate rows with their current leftovers from the resource state
+        df_candidates = df.iloc[positions].copy()
+        for column, leftovers in resource_state[table].items():
+            df_candidates[column] = leftovers[positions]
+        return df_candidates
+
+    def get_candidate(order, df, table, i):
+        # copy the candidate row with its current leftovers, the orders mapped since the candidates were found
+        # may have consumed it, the candidate is skipped if its leftover is not above the threshold anymore
+        candidate = df.iloc[i].copy()
+        position = frames[table].index.get_loc(candidate.name)
+        for column, leftovers in resource_state[table].items():
+            candidate[column] = leftovers[position]
+        if table == 'stock':
+            column = 'sv_leftover' if order['operation_type'] == 'stock' else 'ps_leftover'
+        else:
+            column = 'leftover'
+        return candidate if abs(candidate[column]) > threshold else None
 
-        # map the capacity
-        for i in range(len(df_product_capacity)):
-            mapped_capacity.loc[len(mapped_capacity)] = df_product_capacity.iloc[i]
+    def exclude_self(order, df, positions, operation_type):
+        # suppress selection from self leftovers if the order is a resource of the same type
+        if order['operation_type'] != operation_type:
+            return positions
+        return [position for position in positions if df.index[position] != order.name]
 
-        # update capacity leftovers
-        df_capacity.loc[df_product_capacity.index, 'leftover'] = df_product_capacity['leftover']
+    def find_candidates(order):
 
-        return mapped_capacity, df_capacity
+        # initialize list of branches
+        df_list = []
 
-    def find_resources(order, order_id, label, resources, mapped_resources, mapped_capacity, map_priority, df_bom,
-                       df_capacity, threshold):
+        # record the looked up location of the product
+        if trace is not None:
+            trace['lookups'].add((order['product'], order['loc_from']))
 
-        # unpack the resources
-        df_stock, df_production, df_movement, df_procurement = resources
-        mapped_stock, mapped_production, mapped_movement, mapped_procurement = mapped_resources
+        # check stock
+        # if the order is stock, check previous period solutionvalue leftover,
+        # otherwise check current period_spent leftover
+        if order['operation_type'] == 'stock':
+            positions = lookup_candidates(candidate_index, 'stock_sv',
+                                          (order['product'], order['loc_from'], order['period']))
+        else:
+            positions = lookup_candidates(candidate_index, 'stock_ps',
+                                          (order['product'], order['loc_from'], order['period']))
+        positions = exclude_self(order, df_stock, positions, 'stock')
+        df_product_stock = get_candidates(df_stock, 'stock', positions)
+        if len(df_product_stock) > 0:
+            df_list.append(df_product_stock)
+
+        # find a product at the same location in production, arriving in the order period
+        positions = lookup_candidates(candidate_index, 'production',
+                                      (order['product'], order['loc_from'], order['period']))
+        positions = exclude_self(order, df_production, positions, 'production')
+        df_product_production = get_candidates(df_production, 'production', positions)
+        if len(df_product_production) > 0:
+            df_list.append(df_product_production)
+
+        # check movement arriving in the order period
+        positions = lookup_candidates(candidate_index, 'movement',
+                                      (order['product'], order['loc_from'], order['period']))
+        positions = exclude_self(order, df_movement, positions, 'movement')
+        df_product_movement = get_candidates(df_movement, 'movement', positions)
+        if len(df_product_movement) > 0:
+            df_list.append(df_product_movement)
+
+        # find a product at the same location and same or earlier period in procurement
+        positions = [position for position in
+                     lookup_candidates(candidate_index, 'procurement', (order['product'], order['loc_from']))
+                     if candidate_index['procurement']['period'][position] <= order['period']]
+        positions = exclude_self(order, df_procurement, positions, 'procurement')
+        df_product_procurement = get_candidates(df_procurement, 'procurement', positions)
+        if len(df_product_procurement):
+            df_list.append(df_product_procurement)
+
+        # sort the branches by priority
+        return sorted(df_list, key=lambda d: map_priority[d.iloc[0]['operation_type']])
+
+    def allocate_order(order):
+        # allocate the found resources to the order, yielding the orders which have to be mapped
+        # before the allocation continues: the residuals of the allocated stocks and movements,
+        # the BOM inputs of the allocated productions and the residual of the order itself.
+        # The branches are allocated in the order of map_priority, and the candidates of a branch in the candidate
+        # order of the index: from the latest period to the earliest one, in the order of the resource rows within
+        # a period
 
         # base case
         if abs(order['residual']) < threshold:
-            # convert order to dataframe
-            result = df_stock, df_production, df_movement, df_procurement, df_capacity, \
-                mapped_stock, mapped_production, mapped_movement, mapped_procurement, mapped_capacity
-            return result
+            return
+
+        # iterate over sorted list of branches
+        df_list = find_candidates(order)
+        for df in df_list:
+            # break the loop if the order is fulfilled
+            if abs(order['residual']) < threshold:
+                break
+
+            if df.iloc[0]['operation_type'] == 'stock':
+                # iterate over found stocks
+                for i in range(len(df)):
+                    # break loop if there is no more residual
+                    if abs(order['residual']) < threshold:
+                        break
+                    # get the stock row from the found stocks, they are in the candidate order
+                    product_stock = get_candidate(order, df, 'stock', i)
+                    if product_stock is None:
+                        continue
+
+                    # get mapped result
+                    product_stock = map_stock(order, product_stock)
+
+                    # map the stock residual
+                    yield product_stock
+
+            elif df.iloc[0]['operation_type'] == 'production':
+                # iterate over found productions
+                for i in range(len(df)):
+                    # break loop if there is no more residual
+                    if abs(order['residual']) < threshold:
+                        break
+                    # get the production row from the found productions, they are in the candidate order
+                    product_production = get_candidate(order, df, 'production', i)
+                    if product_production is None:
+                        continue
+
+                    # set the unique id for mapped production and mapped capacity within the order
+                    product_production['prod_id'] = count_mapped_rows(mapped_records, 'production') - production_start
+
+                    # get mapped result
+                    product_production = map_production(order, product_production)
+
+                    # get capacities
+                    capacity_positions = get_capacity(product_production, df_capacity)
+
+                    # map capacities
+                    map_capacity(order_id, label, capacity_positions, product_production, df_capacity)
+
+                    # map BOM
+                    df_bomlist = get_bom_orders(product_production, df_bom)
+                    for j in range(len(df_bomlist)):
+                        # get the BOM item from found BOM list
+                        product_bom_item = df_bomlist.iloc[j].copy()
+
+                        # set the name of the Series to the index-label of the row
+                        product_bom_item.name = df_bomlist.index[j]
+
+                        # map the inputs of the product
+                        yield product_bom_item
+
+                    # map the order residual
+                    yield order
+
+            elif df.iloc[0]['operation_type'] == 'movement':
+                # iterate over found movements
+                for i in range(len(df)):
+                    # break loop if there is no more residual
+                    if abs(order['residual']) < threshold:
+                        break
+                    # get the movement row from the found movements, they are in the candidate order
+                    product_movement = get_candidate(order, df, 'movement', i)
+                    if product_movement is None:
+                        continue
+
+                    # get mapped result
+                    product_movement = map_movement(order, product_movement)
+
+                    # map the movement residual
+                    yield product_movement
 
-        # recursive cases
-        else:
-            # initialize list of branches
-            df_list = []
-
-            # check stock
-            df_product_stock = df_stock[
-                (df_stock['product'] == order['product']) &
-                # if the order is stock, check previous period, otherwise check current stock leftovers
-                (np.where(df_stock['operation_type'] == order['operation_type'],
-                          df_stock['period'] == order['period'] - 1,
-                          df_stock['period'] == order['period'])) &
-                (df_stock['loc_to'] == order['loc_from']) &
-                # if the order is stock, check previous period solutionvalue leftover,
-                # otherwise check current period_spend leftover
-                (np.where(df_stock['operation_type'] == order['operation_type'],
-                          abs(df_stock['sv_leftover']) > threshold,
-                          abs(df_stock['ps_leftover']) > threshold)) &
-                # suppress selection from self leftovers
-                (~df_stock.index.isin([order.name]) | (df_stock['operation_type'] != order['operation_type']))
-                ].copy()
-            if len(df_product_stock) > 0:
-                df_list.append(df_product_stock)
-
-            # find a product at the same location in production
-            df_product_production = df_production[
-                (df_production['product'] == order['product']) &
-                (df_production['period'] == order['period'] - df_production['leadtime']) &
-                (df_production['loc_to'] == order['loc_from']) &
-                (abs(df_production['leftover']) > threshold) &
-                # suppress selection from self
-                (~df_production.index.isin([order.name]) | (df_production['operation_type'] != order['operation_type']))
-                ].copy()
-            if len(df_product_production) > 0:
-                df_list.append(df_product_production)
-
-            # check movement
-            df_product_movement = df_movement[
-                (df_movement['product'] == order['product']) &
-                (df_movement['period'] == order['period'] - df_movement['leadtime']) &
-                (df_movement['loc_to'] == order['loc_from']) &
-                (abs(df_movement['leftover']) > threshold) &
-                # suppress selection from self leftovers
-                (~df_movement.index.isin([order.name]) | (df_movement['operation_type'] != order['operation_type']))
-                ].copy()
-            if len(df_product_movement) > 0:
-                df_list.append(df_product_movement)
-
-            # find a product at the same location and same period in procurement
-            df_product_procurement = df_procurement[
-                (df_procurement['product'] == order['product']) &
-                (df_procurement['period'] <= order['period']) &
-                (df_procurement['loc_to'] == order['loc_from']) &
-                (abs(df_procurement['leftover']) > threshold) &
-                # suppress selection from self leftovers
-                (~df_procurement.index.isin([order.name]) | (
-                            df_procurement['operation_type'] != order['operation_type']))
-                ].copy()
-            if len(df_product_procurement):
-                df_list.append(df_product_procurement)
-
-            recursive_results = []
-            # iterate over sorted list of branches
-            df_list = sorted(df_list, key=lambda d: map_priority[d.iloc[0]['operation_type']])
-            for df in df_list:
-                # break the loop if the order is fulfilled
-                if abs(order['residual']) < threshold:
-                    break
-
-                else:
-                    if df.iloc[0]['operation_type'] == 'stock':
-                        # iterate over found stocks
-                        recursive_results_stock = []
-                        for i in range(len(df)):
-                            # break loop if there is no more residual
-                            if abs(order['residual']) < threshold:
-                                break
-                            # get the stock row from the found stocks
-                            product_stock = df.sort_values('period', ascending=False).iloc[i].copy()
-
-                            # set the name of the Series to the label of the row
-                            product_stock.name = df.index[i]
-
-                            # pack the resources
-                            resources = df_stock, df_production, df_movement, df_procurement
-                            mapped_resources = mapped_stock, mapped_production, mapped_movement, mapped_procurement
-
-                            # get mapped result
-                            product_stock, resources, mapped_resources = map_stock(
-                                order, product_stock,
-                                resources, mapped_resources
-                            )
-
-                            # capture the recursive results
-                            recursive_results_stock.append(
-                                find_resources(
-                                    product_stock, order_id, label,
-                                    resources, mapped_resources, mapped_capacity,
-                                    map_priority,
-                                    df_bom, df_capacity, threshold
-                                )
-                            )
-                        # get the recursive result from the stock branch
-                        recursive_results.append(recursive_results_stock[-1])
-
-                    elif df.iloc[0]['operation_type'] == 'production':
-                        # iterate over found productions
-                        recursive_results_production = []
-                        for i in range(len(df)):
-                            # break loop if there is no more residual
-                            if abs(order['residual']) < threshold:
-                                break
-                            # get the stock row from the found stocks
-                            product_production = df.sort_values('period', ascending=False).iloc[i].copy()
-
-                            # set the name of the Series to the label of the row
-                            product_production.name = df.index[i]
-
-                            # set the unique id for mapped production and mapped capacity
-                            product_production['prod_id'] = len(mapped_production)
-
-                            # pack the resources
-                            resources = df_stock, df_production, df_movement, df_procurement
-                            mapped_resources = mapped_stock, mapped_production, mapped_movement, mapped_procurement
-
-                            # get mapped result
-                            product_production, resources, mapped_resources = map_production(
-                                order, product_production,
-                                resources, mapped_resources
-                            )
-
-                            # get capacities
-                            df_product_capacity = get_capacity(product_production, df_capacity)
-
-                            # map capacities
-                            mapped_capacity, df_capacity = map_capacity(
-                                order_id, label,
-                                df_product_capacity,
-                                product_production,
-                                mapped_capacity,
-                                df_capacity
-                            )
-
-                            # map BOM
-                            df_bomlist = get_bom_orders(product_production, df_bom)
-                            # if the product has inputs
-                            if len(df_bomlist) > 0:
-                                # map BOM
-                                recursive_results_bom = []
-                                for j in range(len(df_bomlist)):
-                                    # get the BOM item from found BOM list
-                                    product_bom_item = df_bomlist.iloc[j].copy()
-
-                                    # set the name of the Series to the index-label of the row
-                                    product_bom_item.name = df_bomlist.index[j]
-
-                                    # capture the recursive results
-                                    recursive_results_bom.append(
-                                        find_resources(
-                                            product_bom_item, order_id, label,
-                                            resources, mapped_resources, mapped_capacity,
-                                            map_priority,
-                                            df_bom, df_capacity,
-                                            threshold
-                                        )
-                                    )
-                                recursive_results_production.append(recursive_results_bom[-1])
-
-                            # capture the recursive results
-                            recursive_results_production.append(
-                                find_resources(
-                                    order, order_id, label,
-                                    resources, mapped_resources, mapped_capacity,
-                                    map_priority,
-                                    df_bom, df_capacity,
-                                    threshold
-                                )
-                            )
-
-                        # get the recursive result from the production branch
-                        recursive_results.append(recursive_results_production[-1])
-
-                    elif df.iloc[0]['operation_type'] == 'movement':
-                        # iterate over found movements
-                        recursive_results_movement = []
-                        for i in range(len(df)):
-                            # break loop if there is no more residual
-                            if abs(order['residual']) < threshold:
-                                break
-                            # get the stock row from the found stocks
-                            product_movement = df.sort_values('period', ascending=False).iloc[i].copy()
-
-                            # set the name of the Series to the label of the row
-                            product_movement.name = df.index[i]
-
-                            # pack the resources
-                            resources = df_stock, df_production, df_movement, df_procurement
-                            mapped_resources = mapped_stock, mapped_production, mapped_movement, mapped_procurement
-
-                            # get mapped result
-                            product_movement, resources, mapped_resources = map_movement(
-                                order, product_movement,
-                                resources, mapped_resources
-                            )
-
-                            # capture the recursive results
-                            recursive_results_movement.append(
-                                find_resources(
-                                    product_movement, order_id, label,
-                                    resources, mapped_resources, mapped_capacity,
-                                    map_priority,
-                                    df_bom, df_capacity,
-                                    threshold
-                                )
-                            )
-                        # get the recursive result from the movement branch
-                        recursive_results.append(recursive_results_movement[-1])
-
-                    else:
-                        # iterate over found procurements
-                        recursive_results_procurement = []
-                        for i in range(len(df)):
-                            # break loop if there is no more residual
-                            if abs(order['residual']) < threshold:
-                                break
-                            # get the stock row from the found stocks
-                            product_procurement = df.sort_values('period', ascending=False).iloc[i].copy()
-
-                            # set the name of the Series to the label of the row
-                            product_procurement.name = df.index[i]
-
-                            # pack the resources
-                            resources = df_stock, df_production, df_movement, df_procurement
-                            mapped_resources = mapped_stock, mapped_production, mapped_movement, mapped_procurement
-
-                            # get mapped result
-                            product_procurement, resources, mapped_resources = map_procurement(
-                                order, product_procurement,
-                                resources, mapped_resources
-                            )
-
-                            # capture the recursive results
-                            recursive_results_procurement.append(
-                                find_resources(
-                                    order, order_id, label,
-                                    resources, mapped_resources, mapped_capacity,
-                                    map_priority,
-                                    df_bom, df_capacity,
-                                    threshold
-                                )
-                            )
-                        # get the recursive result from the procurement branch
-                        recursive_results.append(recursive_results_procurement[-1])
-
-            recursive_result = recursive_results[-1]
-
-        return recursive_result
-
-    return find_resources(
-        order, order_id, label,
-        resources, mapped_resources, mapped_capacity,
-        map_priority,
-        df_bom, df_capacity,
-        threshold
-    )
+            else:
+                # iterate over found procurements
+                for i in range(len(df)):
+                    # break loop if there is no more residual
+                    if abs(order['residual']) < threshold:
+                        break
+                    # get the procurement row from the found procurements, they are in the candidate order
+                    product_procurement = get_candidate(order, df, 'procurement', i)
+                    if product_procurement is None:
+                        continue
+
+                    # get mapped result
+                    map_procurement(order, product_procurement)
+
+                    # map the order residual
+                    yield order
+
+    def find_resources(order):
+        # map the orders yielded by the allocation recursively
+        for child_order in allocate_order(order):
+            find_resources(child_order)
+
+    def find_resources_iterative(order):
+        # map the orders yielded by the allocation depth-first with an explicit stack of allocations,
+        # so that only the allocations on the current path are kept
+        stack = [allocate_order(order)]
+        while stack:
+            child_order = next(stack[-1], None)
+            if child_order is None:
+                stack.pop()
+            else:
+                stack.append(allocate_order(child_order))
+
+    # count the candidates, allocations, depth and durations of the steps of the mapping
+    if stats is not None:
+        find_candidates = counted_candidates(stats, find_candidates)
+        allocate_order = tracked_depth(stats, allocate_order)
+        map_stock = timed(stats, 'stock', map_stock, allocation=True)
+        map_production = timed(stats, 'production', map_production, allocation=True)
+        map_movement = timed(stats, 'movement', map_movement, allocation=True)
+        map_procurement = timed(stats, 'procurement', map_procurement, allocation=True)
+        get_bom_orders = timed(stats, 'bom', get_bom_orders)
+        get_capacity = timed(stats, 'capacity', get_capacity)
+        map_capacity = timed(stats, 'capacity', map_capacity)
+
+    if engine == 'iterative':
+        find_resources_iterative(order)
+    else:
+        find_resources(order)
+
+    # write the leftovers back into the resources
+    if update_frames:
+        update_resource_frames(resource_state, df_stock, df_production, df_movement, df_procurement, df_capacity)
+
+    # create the mapped DataFrames of this order
+    mapped_stock, mapped_production, mapped_movement, mapped_procurement, mapped_capacity = None, None, None, None, None
+    if materialize:
+        _, mapped_stock, mapped_production, mapped_movement, mapped_procurement, mapped_capacity = \
+            materialize_mapped_records(mapped_records)
+
+    return df_stock, df_production, df_movement, df_procurement, df_capacity, \
+        mapped_stock, mapped_production, mapped_movement, mapped_procurement, mapped_capacity
+
+
+def map_sales(df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity, map_priority,
+              threshold=Decimal('0.1'), engine='recursive', verbose=True, traces=None, stats=None,
+              checkpoint_path=None, checkpoint_orders=None, checkpoint_seconds=None, resume=False):
+    """
+    Maps the resources to the sales one at a time in the order of df_sales.
+    With a checkpoint path the progress is saved every checkpoint_orders orders or checkpoint_seconds seconds
+    and after the last order, each save appends the rows mapped since the previous one to the checkpoint file
+    and replaces the saved leftovers of the resources. A resumed mapping continues after the last saved order
+    :param df_sales: pd.DataFrame, sorted sales to be mapped
+    :param df_stock: pd.Dataframe, data related to storage
+    :param df_production: pd.DataFrame, data related to production
+    :param df_movement: pd.Dataframe, data related to transportation
+    :param df_procurement: pd.Dataframe, data related to procurement
+    :param df_bom: pd.Dataframe with BOMs data
+    :param df_capacity: pd.Dataframe, data related to production capacities
+    :param map_priority: dict, priority of resources
+    :param threshold: Decimal or float, threshold for comparing real numbers in the type of the quantities
+    :param engine: str, 'recursive' or 'iterative' mapping engine
+    :param verbose: bool, whether to show the progress of the mapping
+    :param traces: dict, collects the lookups and the resource updates of each order_id
+    :param stats: dict, collects the counters of each order_id
+    :param checkpoint_path: str, file of the checkpoint of the mapping, None does not save the progress
+    :param checkpoint_orders: int, number of orders mapped between two checkpoints, None does not count the orders
+    :param checkpoint_seconds: float, seconds between two checkpoints, None does not time the checkpoints
+    :param resume: bool, whether to continue from the checkpoint of an interrupted mapping
+    :return: tuple of dicts: mapped rows and leftovers of the resources (mapped_records, resource_state)
+    """
+    # index the candidate resources once for all orders
+    candidate_index = build_candidate_index(df_stock, df_production, df_movement, df_procurement, threshold)
+
+    # index the BOM inputs and the capacities once for all orders
+    bom_index = build_bom_index(df_bom, df_capacity)
+
+    # keep the leftovers of the resources in arrays during the mapping
+    resource_state = build_resource_state(df_stock, df_production, df_movement, df_procurement, df_capacity)
+
+    # accumulate the mapped rows of all orders
+    mapped_records = build_mapped_records(df_sales, df_stock, df_production, df_movement, df_procurement, df_capacity)
+
+    # continue after the orders of the checkpoint, with their leftovers and mapped rows
+    completed = 0
+    checkpoint = None
+    if resume:
+        if checkpoint_path is None:
+            raise ValueError('A mapping can only be resumed from a checkpoint path')
+        checkpoint = load_checkpoint(checkpoint_path, df_sales.index, mapped_records)
+        if checkpoint is None:
+            print(f'No checkpoint in {checkpoint_path}, the mapping starts from the first order.')
+    if checkpoint is not None:
+        completed = len(checkpoint['order_ids'])
+        resource_state = checkpoint['resource_state']
+        refresh_candidates(candidate_index, resource_state, threshold)
+        if traces is not None:
+            traces.update(checkpoint['traces'])
+        if stats is not None:
+            stats.update(checkpoint['stats'])
+        checkpoint_log = checkpoint['log']
+        if verbose:
+            print(f'Mapping has been resumed after {completed} of {len(df_sales)} orders.')
+    elif checkpoint_path is not None:
+        # a new mapping starts a new checkpoint, the saves are appended to it
+        remove_checkpoint(checkpoint_path)
+        checkpoint_log = build_checkpoint_log(mapped_records)
+
+    def save(previous, mapped):
+        save_checkpoint(checkpoint_path, checkpoint_log, df_sales.index[previous:mapped], mapped, resource_state,
+                        mapped_records, traces, stats)
+
+    saved, saved_time = completed, time.monotonic()
+
+    # Iterate over rows in sorted sales dataframe
+    sales = df_sales.iloc[completed:].iterrows()
+    for mapped, sale in enumerate(tqdm(sales, total=len(df_sales), initial=completed, disable=not verbose),
+                                  start=completed + 1):
+        # get the order_id and the row of the sale
+        order_id, order = sale
+
+        # name series with its index
+        order.name = order_id
+
+        # label
+        label = order['keys']
+
+        # run recursive mapping and update resources
+        trace = None
+        if traces is not None:
+            trace = traces.setdefault(order_id, {'lookups': set(), 'updates': [], 'capacity': []})
+        order_stats = None
+        if stats is not None:
+            order_stats = stats[order_id] = build_order_stats(order_id, label)
+            start = time.perf_counter()
+        map_resources(order, order_id, label, df_stock, df_production, df_movement, df_procurement,
+                      map_priority, df_bom, df_capacity, threshold, candidate_index,
+                      resource_state, mapped_records, engine, trace, order_stats, bom_index)
+        if stats is not None:
+            order_stats['time']['total'] = time.perf_counter() - start
+
+        if verbose:
+            print(f'\nOrder: {order_id} ({label}) has been mapped.')
+
+        # update mapped sales
+        append_mapped_sale(mapped_records, order, order_id)
+
+        # save the progress
+        if checkpoint_path is not None and (
+                checkpoint_orders is not None and mapped - saved >= checkpoint_orders
+                or checkpoint_seconds is not None and time.monotonic() - saved_time >= checkpoint_seconds):
+            save(saved, mapped)
+            saved, saved_time = mapped, time.monotonic()
+
+    # the last checkpoint holds the whole mapping, it is removed once the outputs are exported
+    if checkpoint_path is not None and saved < len(df_sales):
+        save(saved, len(df_sales))
+
+    return mapped_records, resource_state
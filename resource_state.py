@@ -0,0 +1,55 @@
+import numpy as np
+
+
+# leftover columns which are updated during the mapping
+LEFTOVER_COLUMNS = {
+    'stock': ['is_leftover', 'sv_leftover', 'ps_leftover', 'er_leftover'],
+    'production': ['leftover'],
+    'movement': ['leftover'],
+    'procurement': ['leftover'],
+    'capacity': ['leftover'],
+}
+
+
+def build_resource_state(df_stock, df_production, df_movement, df_procurement, df_capacity):
+    """
+    Copies the leftovers of the resources into NumPy arrays addressed by the integer row position,
+    so that the mapper does not write into the DataFrames on every allocation
+    :param df_stock: pd.Dataframe, data related to storage
+    :param df_production: pd.DataFrame, data related to production
+    :param df_movement: pd.Dataframe, data related to transportation
+    :param df_procurement: pd.Dataframe, data related to procurement
+    :param df_capacity: pd.Dataframe, data related to production capacities
+    :return: dict, arrays of leftovers for each resource table and leftover column
+    """
+    frames = {
+        'stock': df_stock,
+        'production': df_production,
+        'movement': df_movement,
+        'procurement': df_procurement,
+        'capacity': df_capacity,
+    }
+    resource_state = {
+        table: {column: np.array(frames[table][column].to_numpy(), copy=True) for column in columns}
+        for table, columns in LEFTOVER_COLUMNS.items()
+    }
+    return resource_state
+
+
+def update_resource_frames(resource_state, df_stock, df_production, df_movement, df_procurement, df_capacity):
+    """
+    Writes the leftovers from the resource state back into the resource DataFrames
+    :return: tuple of pd.Dataframes: updated resources
+             (df_stock, df_production, df_movement, df_procurement, df_capacity)
+    """
+    frames = {
+        'stock': df_stock,
+        'production': df_production,
+        'movement': df_movement,
+        'procurement': df_procurement,
+        'capacity': df_capacity,
+    }
+    for table, columns in LEFTOVER_COLUMNS.items():
+        for column in columns:
+            frames[table][column] = resource_state[table][column]
+    return df_stock, df_production, df_movement, df_procurement, df_capacity
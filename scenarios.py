@@ -0,0 +1,101 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import config
+import utils
+from data_loader import build_queries, get_sorting, get_threshold, prepare_tables, read_tables, sort_tables
+from entities import build_entity_dictionary, encode_inputs
+from main import summarize_mapping
+from resource_mapper import map_sales
+
+
+# columns identifying an order in the summary tables of the scenarios
+ORDER_COLUMNS = ['demand_location', 'demand_product', 'demand_client', 'demand_period']
+
+# columns of the orders compared between the scenarios
+COMPARED_COLUMNS = ['cost_of_demand', 'margin_per_unit']
+
+# tables read once for all scenarios, shared with the worker processes
+loaded_tables = {}
+
+
+def set_loaded_tables(tables):
+    """ Keeps the loaded tables in the worker process, a forked worker shares their memory until it writes into it """
+    loaded_tables.update(tables)
+
+
+def get_scenario_name(time_direction, priority):
+    """ Returns the name of the scenario used in the columns of the comparison """
+    return f'{time_direction}_{priority}'
+
+
+def map_scenario(time_direction, priority):
+    """
+    Prepares and maps the loaded tables with the time direction and the priority of the scenario
+    :return: pd.DataFrame, compared columns of each order of the scenario, indexed by ORDER_COLUMNS
+    """
+    # the preparation writes into the tables, so the scenario works on its own copies
+    tables = {table: df.copy() for table, df in sort_tables(loaded_tables, time_direction).items()}
+    inputs = prepare_tables(tables, time_direction, priority, config.lead_time, config.numeric_mode,
+                            config.categoricals)
+    entities = build_entity_dictionary(inputs)
+    inputs = encode_inputs(inputs, entities)
+    df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity, df_demand = inputs
+
+    # map the sales of the scenario
+    threshold = get_threshold(config.threshold, config.numeric_mode)
+    mapped_records, resource_state = map_sales(
+        df_sales, df_stock, df_production, df_movement, df_procurement, df_bom, df_capacity,
+        config.map_priority, threshold, config.engine, verbose=False
+    )
+
+    # the order columns repeat on every mapped resource row of the summary table
+    summary_table = summarize_mapping(inputs, mapped_records, resource_state, entities=entities)
+    return summary_table.groupby(ORDER_COLUMNS, observed=True)[COMPARED_COLUMNS].first()
+
+
+def run_scenarios(scenarios, workers=1):
+    """
+    Maps the run of the config with each scenario and exports the cost_of_demand and margin_per_unit of the orders
+    of all scenarios side by side. The inputs are read once, with the time direction of the config,
+    and each scenario is prepared and mapped from them in its own worker process
+    :param scenarios: list, (time_direction, priority) of each scenario
+    :param workers: int, number of scenarios mapped at the same time
+    :return: pd.DataFrame, compared columns of each order and scenario
+    """
+    # read the tables once
+    queries = build_queries(config.configid, config.datasetid, config.runid, config.period,
+                            get_sorting(config.time_direction), config.threshold)
+    tables = read_tables(queries, config.load_method, config.numeric_mode, config.db_connections)
+
+    # map the scenarios in parallel
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_loaded_tables, initargs=(tables,)) as executor:
+        results = list(executor.map(map_scenario, *zip(*scenarios)))
+
+    # put the columns of the scenarios side by side, orders missing in a scenario are left empty
+    comparison = pd.DataFrame({
+        f'{column}_{get_scenario_name(*scenario)}': result[column]
+        for column in COMPARED_COLUMNS for scenario, result in zip(scenarios, results)
+    })
+
+    utils.export_tables('results/scenario_comparison', {'comparison': (comparison, True)})
+
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maps the run of the config with several time directions and '
+                                                 'priorities and compares the orders side by side')
+    parser.add_argument('--scenarios', nargs='+', metavar='TIME_DIRECTION:PRIORITY',
+                        help='scenarios to map, config.scenarios if not given')
+    parser.add_argument('--workers', type=int, default=config.scenario_workers,
+                        help='number of scenarios mapped at the same time')
+    args = parser.parse_args()
+
+    if args.scenarios:
+        scenarios = [tuple(scenario.split(':', 1)) for scenario in args.scenarios]
+    else:
+        scenarios = config.scenarios
+    run_scenarios(scenarios, args.workers)
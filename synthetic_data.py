@@ -0,0 +1,140 @@
+import random
+from decimal import Decimal
+
+import pandas as pd
+
+
+def to_decimal(value):
+    """ Converts the value into Decimal with 6 decimal places, as the NUMERIC values returned by psycopg2 """
+    return Decimal(f'{value:.6f}')
+
+
+def generate_tables(products=10, locations=6, periods=3, bom_depth=2, fan_in=2, lanes=20, sales=100, plants=2,
+                    resources=1, suppliers=2, time_direction='backward', seed=0):
+    """
+    Generates the optimizer data and results of a synthetic supply network, in the form of the tables read by
+    data_loader, so that they can be prepared with prepare_tables without a database.
+    The products are split into BOM levels: the products of the lowest level are procured,
+    the products of the other levels are produced from fan_in products of the level below,
+    and the products of the highest level are sold
+    :param products: int, number of products
+    :param locations: int, number of locations
+    :param periods: int, number of periods
+    :param bom_depth: int, number of production levels above the procured products
+    :param fan_in: int, number of inputs of each BOM
+    :param lanes: int, number of transport lanes of a product between two locations
+    :param sales: int, number of sales
+    :param plants: int, number of locations producing each produced product
+    :param resources: int, number of capacity resources of each BOM
+    :param suppliers: int, number of locations procuring each procured product
+    :param time_direction: str, 'backward' or 'forward' order of the periods of the results
+    :param seed: int, seed of the random generator
+    :return: dict, pd.DataFrame of each queried table
+    """
+    rnd = random.Random(seed)
+    location_names = [f'loc{i}' for i in range(locations)]
+    period_list = list(range(periods))
+
+    # split the products into levels, the lowest level is procured
+    levels = [[] for _ in range(bom_depth + 1)]
+    for i in range(products):
+        levels[min(i * (bom_depth + 1) // products, bom_depth)].append(f'prod{i}')
+    procured = levels[0]
+    finished = levels[-1]
+
+    tables = {table: [] for table in [
+        'optimizer_production', 'results_production', 'optimizer_transportation', 'results_movement',
+        'optimizer_procurement', 'results_procurement', 'optimizer_storage', 'results_stock', 'optimizer_demand',
+        'results_sale', 'optimizer_bom',
+    ]}
+
+    # productions and BOMs
+    for level in range(1, bom_depth + 1):
+        for product in levels[level]:
+            inputs = rnd.sample(levels[level - 1], min(fan_in, len(levels[level - 1])))
+            for location in rnd.sample(location_names, min(plants, locations)):
+                bomnum = f'{product}{location}'
+                for period in period_list:
+                    duration = rnd.choice([0, 1])
+                    cost = to_decimal(-rnd.uniform(1, 5))
+                    for resource in range(resources):
+                        tables['optimizer_production'].append(
+                            (location, product, bomnum, period, duration, cost, Decimal(1), f'res{location}{resource}',
+                             to_decimal(rnd.uniform(1000, 10000)), to_decimal(rnd.uniform(0.5, 2))))
+                    tables['results_production'].append(
+                        (location, product, bomnum, period, to_decimal(rnd.uniform(10, 200))))
+                    tables['optimizer_bom'].append((bomnum, location, product, Decimal(1), period))
+                    for item in inputs:
+                        tables['optimizer_bom'].append(
+                            (bomnum, location, item, to_decimal(-rnd.uniform(0.5, 1.5)), period))
+
+    # procurements
+    for product in procured:
+        for location in rnd.sample(location_names, min(suppliers, locations)):
+            for period in period_list:
+                supplier = f'sup{product}'
+                tables['optimizer_procurement'].append(
+                    (location, product, period, supplier, to_decimal(-rnd.uniform(1, 9)), Decimal(1)))
+                tables['results_procurement'].append(
+                    (location, product, period, to_decimal(rnd.uniform(20, 300)), supplier))
+
+    # transport lanes, each (product, loc_from, loc_to) at most once as in the key-unique optimizer tables
+    moved = procured + [product for level in levels[1:] for product in level]
+    lane_keys = set()
+    while len(lane_keys) < min(lanes, len(moved) * locations * (locations - 1)):
+        lane_keys.add((rnd.choice(moved), *rnd.sample(location_names, 2)))
+    for product, loc_from, loc_to in sorted(lane_keys):
+        for period in period_list:
+            tables['optimizer_transportation'].append(
+                (loc_from, loc_to, product, period, 'auto', rnd.choice([0, 1]), to_decimal(-rnd.uniform(1, 7)),
+                 Decimal(1)))
+            tables['results_movement'].append(
+                (loc_from, loc_to, product, period, to_decimal(rnd.uniform(5, 150)), 'auto'))
+
+    # storage of every product at every location
+    for product in [product for level in levels for product in level]:
+        for location in location_names:
+            for period in period_list:
+                initialstock = to_decimal(rnd.uniform(0, 100)) if period == 0 else None
+                tables['optimizer_storage'].append(
+                    (location, product, initialstock, period, to_decimal(-rnd.uniform(0.5, 2)), Decimal(1)))
+                solutionvalue = to_decimal(rnd.uniform(0, 80)) if rnd.random() < 0.6 else Decimal(0)
+                tables['results_stock'].append((location, product, period, solutionvalue))
+
+    # sales of the finished products, each sale has its own demand
+    clients = max(1, -(-sales // (len(finished) * locations * periods)))
+    sale_keys = rnd.sample([(location, product, f'cl{client}', period) for location in location_names
+                            for product in finished for client in range(clients) for period in period_list],
+                           min(sales, len(finished) * locations * clients * periods))
+    for location, product, client, period in sale_keys:
+        quantity = rnd.randint(50, 400)
+        tables['optimizer_demand'].append(
+            (location, product, client, Decimal(quantity), to_decimal(rnd.uniform(10, 60)), period))
+        tables['results_sale'].append(
+            (location, product, client, to_decimal(quantity * rnd.uniform(0.5, 1)), period))
+
+    columns = {
+        'optimizer_production': ['location', 'product', 'bomnum', 'period', 'duration', 'cost', 'coefficient',
+                                 'resource', 'capacity', 'var_production_cons'],
+        'results_production': ['location', 'product', 'bomnum', 'period', 'solutionvalue'],
+        'optimizer_transportation': ['loc_from', 'loc_to', 'product', 'period', 'transport_type', 'duration', 'cost',
+                                     'coefficient'],
+        'results_movement': ['loc_from', 'loc_to', 'product', 'period', 'solutionvalue', 'transport_type'],
+        'optimizer_procurement': ['location', 'product', 'period', 'supplier', 'cost', 'coefficient'],
+        'results_procurement': ['location', 'product', 'period', 'solutionvalue', 'supplier'],
+        'optimizer_storage': ['location', 'product', 'initialstock', 'period', 'cost', 'coefficient'],
+        'results_stock': ['location', 'product', 'period', 'solutionvalue'],
+        'optimizer_demand': ['location', 'product', 'client', 'quantity', 'price', 'period'],
+        'results_sale': ['location', 'product', 'client', 'solutionvalue', 'period'],
+        'optimizer_bom': ['bomnum', 'location', 'product', 'input_output', 'period'],
+    }
+
+    # order the rows by period as the queries do, the lanes of the optimizer data are not ordered
+    frames = {}
+    for table, rows in tables.items():
+        df = pd.DataFrame(rows, columns=columns[table])
+        if table not in ('optimizer_production', 'optimizer_transportation'):
+            df = df.sort_values('period', ascending=time_direction == 'forward', kind='stable').reset_index(drop=True)
+        frames[table] = df
+
+    return frames
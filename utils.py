@@ -2,27 +2,87 @@ import pandas as pd
 import config
 
 
+# file extensions of the output formats and of the CSV compressions
+OUTPUT_EXTENSIONS = {'excel': '.xlsx', 'parquet': '.parquet', 'csv': '.csv', 'arrow': '.arrow'}
+CSV_COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'bz2': '.bz2', 'zip': '.zip', 'xz': '.xz', 'zstd': '.zst'}
+
+# inferred types of the object columns which may hold Decimal numbers
+MIXED_DTYPES = ('decimal', 'mixed', 'mixed-integer', 'mixed-integer-float')
+
+
+def to_columnar(df, index):
+    """
+    Prepares the DataFrame for the columnar formats: the index is kept as columns if required
+    and the object columns of Decimal numbers are converted into float64, as they are written into Excel
+    """
+    if index:
+        df = df.reset_index()
+    df = df.copy()
+    for column in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[column], skipna=True) in MIXED_DTYPES:
+            try:
+                df[column] = pd.to_numeric(df[column]).astype('float64')
+            except (ValueError, TypeError):
+                pass
+    return df
+
+
+def export_tables(filepath, tables, output_format=None):
+    """
+    Exports the tables with the output format of the config.
+    Excel writes the tables into the sheets of one workbook, the other formats write one file per table
+    :param filepath: str, path of the output without the extension
+    :param tables: dict, (pd.DataFrame, whether to write its index) of each sheet name
+    :param output_format: str, 'excel', 'parquet', 'csv' or 'arrow', config.output_format if not given
+    """
+    output_format = output_format or config.output_format
+    compression = config.output_compression
+
+    if output_format == 'excel':
+        with pd.ExcelWriter(filepath + OUTPUT_EXTENSIONS['excel']) as writer:
+            for sheet_name, (df, index) in tables.items():
+                df.to_excel(writer, sheet_name=sheet_name, index=index)
+        return
+
+    for sheet_name, (df, index) in tables.items():
+        table_filepath = f'{filepath}_{sheet_name}{OUTPUT_EXTENSIONS[output_format]}'
+        if output_format == 'csv':
+            table_filepath += CSV_COMPRESSION_EXTENSIONS.get(compression, '')
+            df.to_csv(table_filepath, index=index, compression=compression)
+        elif output_format == 'parquet':
+            to_columnar(df, index).to_parquet(table_filepath, index=False, compression=compression or 'snappy',
+                                              row_group_size=config.output_row_group_size)
+        elif output_format == 'arrow':
+            # Arrow IPC file format, written in record batches of the row group size
+            to_columnar(df, index).to_feather(table_filepath, compression=compression,
+                                              chunksize=config.output_row_group_size)
+        else:
+            raise ValueError(f'Unknown output format: {output_format}')
+
+
 def export_input_resources(df_results_sale, df_results_stock, df_results_production, df_results_movement,
                            df_results_procurement):
-    """ Exports input resources before mapping into Excel spreadsheet """
+    """ Exports input resources before mapping with the output format of the config """
 
-    filepath = f'input/resource_mapper_input_{config.time_direction}_{config.priority}.xlsx'
+    filepath = f'input/resource_mapper_input_{config.time_direction}_{config.priority}'
 
-    with pd.ExcelWriter(filepath) as writer:
-        df_results_sale.to_excel(writer, sheet_name='sales')
-        df_results_stock.to_excel(writer, sheet_name='stock', index=False)
-        df_results_production.to_excel(writer, sheet_name='production', index=False)
-        df_results_movement.to_excel(writer, sheet_name='movement', index=False)
-        df_results_procurement.to_excel(writer, sheet_name='procurement', index=False)
+    export_tables(filepath, {
+        'sales': (df_results_sale, True),
+        'stock': (df_results_stock, False),
+        'production': (df_results_production, False),
+        'movement': (df_results_movement, False),
+        'procurement': (df_results_procurement, False),
+    })
 
 
 def export_mapped_resources(mapped_sales, mapped_stock, mapped_production, mapped_movement, mapped_procurement,
                             mapped_capacity):
-    """ Exports mapped resources into Excel spreadsheet """
+    """ Exports mapped resources with the output format of the config """
 
-    filepath = f'results/resource_mapped_results_{config.time_direction}_{config.priority}.xlsx'
-    with pd.ExcelWriter(filepath) as writer:
-        mapped_sales[
+    filepath = f'results/resource_mapped_results_{config.time_direction}_{config.priority}'
+
+    export_tables(filepath, {
+        'mapped_sales': (mapped_sales[
             [
                 'keys',
                 'location',
@@ -38,9 +98,8 @@ def export_mapped_resources(mapped_sales, mapped_stock, mapped_production, mappe
                 'total_cost',
                 'unit_cost'
             ]
-        ].to_excel(writer, sheet_name='mapped_sales')
-
-        mapped_stock[
+        ], True),
+        'mapped_stock': (mapped_stock[
             [
                 'order_id',
                 'label',
@@ -58,9 +117,8 @@ def export_mapped_resources(mapped_sales, mapped_stock, mapped_production, mappe
                 'cost',
                 'total_cost'
             ]
-        ].to_excel(writer, sheet_name='mapped_stock', index=False)
-
-        mapped_production[
+        ], False),
+        'mapped_production': (mapped_production[
             [
                 'order_id',
                 'label',
@@ -74,9 +132,8 @@ def export_mapped_resources(mapped_sales, mapped_stock, mapped_production, mappe
                 'leftover',
                 'oder_operation_volume'
             ]
-        ].to_excel(writer, sheet_name='mapped_production', index=False)
-
-        mapped_movement[
+        ], False),
+        'mapped_movement': (mapped_movement[
             [
                 'order_id',
                 'label',
@@ -94,9 +151,8 @@ def export_mapped_resources(mapped_sales, mapped_stock, mapped_production, mappe
                 'cost',
                 'total_cost'
             ]
-        ].to_excel(writer, sheet_name='mapped_movement', index=False)
-
-        mapped_procurement[
+        ], False),
+        'mapped_procurement': (mapped_procurement[
             [
                 'order_id',
                 'label',
@@ -112,9 +168,8 @@ def export_mapped_resources(mapped_sales, mapped_stock, mapped_production, mappe
                 'cost',
                 'total_cost'
             ]
-        ].to_excel(writer, sheet_name='mapped_procurement', index=False)
-
-        mapped_capacity[
+        ], False),
+        'mapped_capacity': (mapped_capacity[
             [
                 'order_id',
                 'label',
@@ -132,26 +187,25 @@ def export_mapped_resources(mapped_sales, mapped_stock, mapped_production, mappe
                 'cost',
                 'total_cost'
             ]
-        ].to_excel(writer, sheet_name='mapped_capacity', index=False)
+        ], False),
+    })
 
 
 def export_output_resources(df_stock, df_production, df_movement, df_procurement, df_capacity):
-    """ Exports resources after mapping into Excel file """
+    """ Exports resources after mapping with the output format of the config """
 
-    filepath = f'results/resource_output_resources_{config.time_direction}_{config.priority}.xlsx'
+    filepath = f'results/resource_output_resources_{config.time_direction}_{config.priority}'
 
-    with pd.ExcelWriter(filepath) as writer:
-        df_stock.drop(['loc_from', 'loc_to'], axis=1).to_excel(writer, sheet_name='output_stock', index=False)
-        df_production.drop(['loc_from', 'loc_to'], axis=1).to_excel(writer, sheet_name='output_production', index=False)
-        df_movement.to_excel(writer, sheet_name='output_movement', index=False)
-        df_procurement.drop(['loc_from', 'loc_to'], axis=1).to_excel(writer, sheet_name='output_procurement',
-                                                                     index=False)
-        df_capacity.to_excel(writer, sheet_name='output_capacity', index=False)
+    export_tables(filepath, {
+        'output_stock': (df_stock.drop(['loc_from', 'loc_to'], axis=1), False),
+        'output_production': (df_production.drop(['loc_from', 'loc_to'], axis=1), False),
+        'output_movement': (df_movement, False),
+        'output_procurement': (df_procurement.drop(['loc_from', 'loc_to'], axis=1), False),
+        'output_capacity': (df_capacity, False),
+    })
 
 
-def export_summary_table(summary_table):
-    """ Exports the summary table into Excel spreadsheet """
-    filepath = f'results/marking_demand.xlsx'
+def export_summary_table(summary_table, filepath='results/marking_demand'):
+    """ Exports the summary table with the output format of the config """
 
-    with pd.ExcelWriter(filepath) as writer:
-        summary_table.to_excel(writer, sheet_name='summary_table', index=False)
+    export_tables(filepath, {'summary_table': (summary_table, False)})